@@ -1,55 +1,198 @@
-from typing import TypedDict, List, Dict, Optional, Any
+import asyncio
+import copy
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from types import MappingProxyType
+from typing import TypedDict, List, Dict, Optional, Any, Tuple, Annotated, Mapping
 from langgraph.graph import StateGraph, END
+from langgraph.types import Send
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import uvloop
+except ImportError:
+    # uvloop is optional and not available on Windows; fall back to the default loop
+    uvloop = None
+
+
+def _create_session(pool_size: int) -> requests.Session:
+    """Build a keep-alive session so every workflow call reuses pooled sockets"""
+    session = requests.Session()
+    # Every call targets the single reasoner host, so one pool holding a socket per
+    # in-flight request is enough; nothing is opened only to be discarded on release
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=Retry(total=3, backoff_factor=0.2, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class _TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl`` seconds"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class _RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` calls per ``period`` seconds"""
+
+    def __init__(self, rate: int, period: float):
+        self.capacity = rate
+        self.fill_rate = rate / period
+        self._tokens = float(rate)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.fill_rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.fill_rate
+            time.sleep(wait)
+
 
 # ===== REASONER API CLIENT =====
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+
 class ReasonerAPI:
     """API client for the reasoner service"""
 
     BASE_URL = "http://localhost:5000"  # Local reasoner service
-
-    @staticmethod
-    def fetch_context(student_id: str) -> Dict[str, Any]:
-        response = requests.post(
-            f"{ReasonerAPI.BASE_URL}/context",
-            json={"student_id": student_id},
-            timeout=10,
-        )
-        response.raise_for_status()
-        return response.json()
-
-    @staticmethod
-    def recommend_template(context: Dict[str, Any]) -> Dict[str, Any]:
-        response = requests.post(
-            f"{ReasonerAPI.BASE_URL}/template/recommend",
-            json=context,
-            timeout=10,
-        )
+    # Caps for the stage fan-out so bursts don't overwhelm the reasoner; values below 1
+    # would stall every request (or divide by zero), so they are clamped to 1
+    max_concurrency = max(1, int(os.getenv("REASONER_MAX_CONCURRENCY", "8")))
+    rate_limit = max(1, int(os.getenv("REASONER_RATE_LIMIT", "100")))  # requests per rate_period
+    rate_period = 60.0
+
+    _session = _create_session(max_concurrency)
+    _slots = threading.BoundedSemaphore(max_concurrency)
+    _rate_limiter = _RateLimiter(rate_limit, rate_period)
+    # Template definitions are static, so repeated workflow runs skip the round-trip
+    _template_cache = _TTLCache(maxsize=64, ttl=300)
+    # Short-lived so HITL reruns for the same student stay warm without serving stale data for long
+    _context_cache = _TTLCache(maxsize=1024, ttl=60)
+
+    @classmethod
+    def _request(cls, method: str, path: str, body: Optional[bytes] = None) -> Any:
+        """Send an orjson-encoded body (if any) and decode the JSON reply with orjson"""
+        headers = _JSON_HEADERS if body is not None else None
+        cls._rate_limiter.acquire()
+        with cls._slots:
+            response = cls._session.request(
+                method, f"{cls.BASE_URL}{path}", data=body, headers=headers, timeout=10
+            )
         response.raise_for_status()
-        return response.json()
-
-    @staticmethod
-    def fetch_template(template_name: str) -> Dict[str, Any]:
-        """API call to fetch template definition (stages, metadata)"""
-        response = requests.get(
-            f"{ReasonerAPI.BASE_URL}/templates/{template_name.lower()}",
-            timeout=10,
-        )
-        response.raise_for_status()
-        return response.json()
-
-    @staticmethod
-    def propose_activities(stage: str, context: Dict[str, Any]) -> Dict[str, Any]:
-        response = requests.post(
-            f"{ReasonerAPI.BASE_URL}/activities/propose",
-            json={"stage": stage, "context": context},
-            timeout=10,
-        )
-        response.raise_for_status()
-        return response.json()
+        return orjson.loads(response.content)
+
+    @classmethod
+    def fetch_context(cls, student_id: str) -> Mapping[str, Any]:
+        """API call to fetch student context; the result is shared and read-only"""
+        context = cls._context_cache.get(student_id)
+        if context is not None:
+            return context
+
+        context = MappingProxyType(cls._request("POST", "/context", orjson.dumps({"student_id": student_id})))
+        cls._context_cache.set(student_id, context)
+        return context
+
+    @classmethod
+    def invalidate_context(cls, student_id: str) -> None:
+        """Drop a cached context so the next fetch hits the reasoner"""
+        cls._context_cache.pop(student_id)
+
+    @classmethod
+    def recommend_template(cls, context: Dict[str, Any]) -> Dict[str, Any]:
+        return cls._request("POST", "/template/recommend", orjson.dumps(context))
+
+    @classmethod
+    def fetch_template(cls, template_name: str) -> Dict[str, Any]:
+        """API call to fetch template definition (stages, metadata); callers get their own copy"""
+        template_key = template_name.lower()
+        definition = cls._template_cache.get(template_key)
+        if definition is None:
+            definition = cls._request("GET", f"/templates/{template_key}")
+            cls._template_cache.set(template_key, definition)
+        # Workflow state and results carry the definition onward, so never hand out the cached one
+        return copy.deepcopy(definition)
+
+    # The stage 2 calls take the shared (stage-independent) context pre-serialized with
+    # orjson, so it is encoded once per workflow and spliced into each request body.
+    @classmethod
+    def upload_context(cls, shared_json: bytes) -> str:
+        """API call storing a shared stage context server-side; returns its context_id"""
+        return cls._request("POST", "/context/cache", shared_json)["context_id"]
+
+    @classmethod
+    def propose_activities(
+        cls, stage: str, shared_json: Optional[bytes] = None, context_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        if context_id:
+            body = orjson.dumps({"stage": stage, "context_id": context_id})
+        else:
+            # Same shape as {"stage": stage, "context": {"stage": stage, **shared}}
+            stage_json = orjson.dumps(stage)
+            shared_fields = shared_json[1:-1]
+            body = b"".join((
+                b'{"stage":', stage_json,
+                b',"context":{"stage":', stage_json, b"," if shared_fields else b"", shared_fields, b"}}",
+            ))
+        return cls._request("POST", "/activities/propose", body)
+
+    @classmethod
+    def propose_activities_batch(cls, stages: List[str], shared_json: bytes) -> Dict[str, Dict[str, Any]]:
+        """API call proposing activities for several stages in one round-trip"""
+        body = b'{"stages":' + orjson.dumps(stages) + b',"context":' + shared_json + b"}"
+        return cls._request("POST", "/activities/propose_batch", body)
 
 
 # ===== STATE DEFINITION =====
+def _merge_dicts(left: Dict[str, Any], right: Dict[str, Any]) -> Dict[str, Any]:
+    return {**left, **right}
+
+
 class State(TypedDict, total=False):
     student_id: str
     student_info: Dict[str, Any]
@@ -59,6 +202,7 @@ class State(TypedDict, total=False):
     pre_slos: List[str]
 
     template_options: List[str]
+    template_cache: Dict[str, Dict[str, Any]]
     chosen_template: Optional[str]
     template_recommendation: Optional[Dict[str, Any]]
     template_stages: List[str]
@@ -66,29 +210,71 @@ class State(TypedDict, total=False):
     template_approved: Optional[bool]
     template_adjustments: List[str]
     current_stage: Optional[str]
+    context_id: Optional[str]
+    shared_context_json: bytes
 
-    stage_activities: Dict[str, List[Dict[str, Any]]]
+    # Merged per key so parallel stage tasks don't clobber each other's results
+    proposed_activities: Annotated[Dict[str, List[Dict[str, Any]]], _merge_dicts]
+    stage_activities: Annotated[Dict[str, List[Dict[str, Any]]], _merge_dicts]
     is_complete: bool
     final_output: Optional[Dict[str, Any]]
 
 
 # ===== STAGE 1 =====
+TEMPLATE_OPTIONS = ["5E", "7E", "PBL", "Dynamic"]
+_VALID_TEMPLATES = frozenset(name.upper() for name in TEMPLATE_OPTIONS)
+
+# Stages used when the template definition cannot be fetched
+_DEFAULT_STAGES = {
+    "5E": ("Engage", "Explore", "Explain", "Elaborate", "Evaluate"),
+    "7E": ("Elicit", "Engage", "Explore", "Explain", "Elaborate", "Evaluate", "Extend"),
+    "PBL": ("Challenge", "Investigate", "Create", "Debrief"),
+}
+
+
+def _warm_template_cache() -> None:
+    """Fill ReasonerAPI's template cache so init_template never waits on the network"""
+    for name in TEMPLATE_OPTIONS:
+        try:
+            ReasonerAPI.fetch_template(name)
+        except Exception as e:
+            print(f"Error warming template cache for {name}: {e}")
+
+
+# Opt-in: long-running processes can prefetch all template definitions at import time
+if os.getenv("EDTECK_WARM_CACHE") == "1":
+    threading.Thread(target=_warm_template_cache, name="template-cache-warmer", daemon=True).start()
+
+
 def stage1_fetch_context(state: State) -> State:
     print("\n=== STAGE 1: FETCHING CONTEXT ===")
+    # Template definitions only depend on the name, so fetch them alongside the context
+    template_cache: Dict[str, Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=len(TEMPLATE_OPTIONS) + 1) as executor:
+        context_future = executor.submit(ReasonerAPI.fetch_context, state["student_id"])
+        template_futures = {name: executor.submit(ReasonerAPI.fetch_template, name) for name in TEMPLATE_OPTIONS}
+        for name, future in template_futures.items():
+            try:
+                template_cache[name.upper()] = future.result()
+            except Exception as e:
+                print(f"Error prefetching template {name}: {e}")
+
     try:
-        context = ReasonerAPI.fetch_context(state["student_id"])
+        context = context_future.result()
+        # The cached context is only read-only at the top level; copy the nested
+        # values so workflow state and its output never alias the cache
         return {
-            **state,
-            "student_info": context.get("student_info", {}),
+            "student_info": copy.deepcopy(context.get("student_info", {})),
             "grade": context.get("grade", ""),
             "subject": context.get("subject", ""),
-            "slos": context.get("slos", []),
-            "pre_slos": context.get("pre_slos", []),
-            "template_options": ["5E", "7E", "PBL", "Dynamic"],  # Placeholder
+            "slos": list(context.get("slos", [])),
+            "pre_slos": list(context.get("pre_slos", [])),
+            "template_options": TEMPLATE_OPTIONS,  # Placeholder
+            "template_cache": template_cache,
         }
     except Exception as e:
         print(f"Error fetching context: {e}")
-        return {**state, "template_options": ["5E", "7E", "PBL", "Dynamic"]}
+        return {"template_options": TEMPLATE_OPTIONS, "template_cache": template_cache}
 
 
 def stage1_recommend_template(state: State) -> State:
@@ -102,10 +288,10 @@ def stage1_recommend_template(state: State) -> State:
             "student_info": state.get("student_info", {}),
         }
         recommendation = ReasonerAPI.recommend_template(context)
-        return {**state, "template_recommendation": recommendation}
+        return {"template_recommendation": recommendation}
     except Exception as e:
         print(f"Error getting template recommendation: {e}")
-        return {**state, "template_recommendation": {"template": "5E", "confidence": 0}}
+        return {"template_recommendation": {"template": "5E", "confidence": 0}}
 
 
 def stage1_choose_template(state: State) -> State:
@@ -117,33 +303,26 @@ def stage1_choose_template(state: State) -> State:
 
     chosen = input(f"Enter template to use (default={rec.get('template','5E')}): ").strip() or rec.get("template", "5E")
     chosen = chosen.upper()
-    if chosen not in {"5E", "7E", "PBL", "DYNAMIC"}:
+    if chosen not in _VALID_TEMPLATES:
         print(f"Unknown template '{chosen}', defaulting to 5E.")
         chosen = "5E"
-    return {**state, "chosen_template": chosen}
+    return {"chosen_template": chosen}
 
 
 # ===== TEMPLATE INIT (via API) =====
 def init_template(state: State) -> State:
-    """Fetch template definition via API"""
+    """Fetch template definition via API, preferring the stage 1 prefetch"""
     template = state.get("chosen_template", "5E")
     print(f"\n=== INIT TEMPLATE: {template} ===")
     try:
-        definition = ReasonerAPI.fetch_template(template)
+        definition = state.get("template_cache", {}).get(template) or ReasonerAPI.fetch_template(template)
         stages = definition.get("stages", [])
     except Exception as e:
         print(f"Error fetching template definition: {e}")
         # Fallback hardcoded defaults
-        if template == "5E":
-            stages = ["Engage", "Explore", "Explain", "Elaborate", "Evaluate"]
-        elif template == "7E":
-            stages = ["Elicit", "Engage", "Explore", "Explain", "Elaborate", "Evaluate", "Extend"]
-        elif template == "PBL":
-            stages = ["Challenge", "Investigate", "Create", "Debrief"]
-        else:
-            stages = []
+        stages = list(_DEFAULT_STAGES.get(template, ()))
 
-    return {**state, "template_stages": stages}
+    return {"template_stages": stages}
 
 
 # ===== STAGE 2 =====
@@ -153,7 +332,7 @@ def stage2_template_approval(state: State) -> State:
     print(f"Stages: {state.get('template_stages', [])}")
     ans = input("Approve template? (y/n) [y]: ").strip().lower()
     approved = (ans != "n")
-    return {**state, "template_approved": approved}
+    return {"template_approved": approved}
 
 
 def stage2_template_adjustment(state: State) -> State:
@@ -166,65 +345,114 @@ def stage2_template_adjustment(state: State) -> State:
         new_stages = input("Enter comma-separated list of stages: ").split(",")
         new_stages = [s.strip() for s in new_stages if s.strip()]
         adjustments = new_stages
-        return {**state, "template_stages": new_stages, "template_adjustments": adjustments}
-    return {**state, "template_adjustments": adjustments}
-
+        return {"template_stages": new_stages, "template_adjustments": adjustments}
+    return {"template_adjustments": adjustments}
 
-def stage2_prepare_stages(state: State) -> State:
-    stages = state.get("template_stages", [])
-    return {**state, "current_stage": stages[0] if stages else None, "stage_activities": state.get("stage_activities", {})}
-
-
-def stage2_populate_stage(state: State) -> State:
-    current_stage = state.get("current_stage")
-    if not current_stage:
-        return state
-    print(f"\n=== POPULATING STAGE: {current_stage} ===")
 
-    context = {
-        "stage": current_stage,
+def _encode_shared_context(state: State) -> bytes:
+    return orjson.dumps({
         "grade": state.get("grade", ""),
         "subject": state.get("subject", ""),
         "slos": state.get("slos", []),
         "pre_slos": state.get("pre_slos", []),
         "student_info": state.get("student_info", {}),
-    }
+    })
+
 
+def _fetch_batch_activities(stages: List[str], shared_json: bytes) -> Dict[str, List[Dict[str, Any]]]:
+    """Propose activities for all stages in one call; stages left out are fanned out later"""
     try:
-        response = ReasonerAPI.propose_activities(current_stage, context)
+        response = ReasonerAPI.propose_activities_batch(stages, shared_json)
+        return {stage: result.get("activities", []) for stage, result in response.items()}
+    except requests.HTTPError as e:
+        # Older reasoner services only expose the per-stage endpoint
+        if e.response is None or e.response.status_code != 404:
+            print(f"Error fetching batched activities: {e}")
+    except Exception as e:
+        print(f"Error fetching batched activities: {e}")
+    return {}
+
+
+def _propose_stage_activities(state: State, stage: str) -> Dict[str, Any]:
+    context_id = state.get("context_id")
+    if context_id:
+        try:
+            return ReasonerAPI.propose_activities(stage, context_id=context_id)
+        except requests.HTTPError as e:
+            # Ids live in a single reasoner process; resend the full context if this one is unknown
+            if e.response is None or e.response.status_code != 404:
+                raise
+    return ReasonerAPI.propose_activities(stage, state["shared_context_json"])
+
+
+def stage2_fetch_all_activities(state: State) -> State:
+    """Fetch proposals for every stage before any HITL prompt is shown"""
+    stages = state.get("template_stages", [])
+    print("\n=== FETCHING STAGE ACTIVITIES ===")
+    shared_json = _encode_shared_context(state)
+    proposed = _fetch_batch_activities(stages, shared_json) if stages else {}
+
+    # Stages the batch missed are fetched one by one; upload their shared context only once
+    context_id = None
+    if any(stage not in proposed for stage in stages):
+        try:
+            context_id = ReasonerAPI.upload_context(shared_json)
+        except requests.HTTPError as e:
+            # Services without the batch endpoint lack /context/cache too; send full contexts
+            if e.response is None or e.response.status_code != 404:
+                print(f"Error uploading shared context: {e}")
+        except Exception as e:
+            print(f"Error uploading shared context: {e}")
+    return {"proposed_activities": proposed, "context_id": context_id, "shared_context_json": shared_json}
+
+
+def stage2_dispatch_stages(state: State):
+    """Fan out one populate task per stage that the batch call did not cover"""
+    proposed = state.get("proposed_activities", {})
+    sends = [
+        Send("stage2_populate_stage", {**state, "current_stage": stage})
+        for stage in state.get("template_stages", [])
+        if stage not in proposed
+    ]
+    return sends or "stage2_approve_activities"
+
+
+def stage2_populate_stage(state: State) -> State:
+    current_stage = state["current_stage"]
+    try:
+        response = _propose_stage_activities(state, current_stage)
         activities = response.get("activities", [])
     except Exception as e:
-        print(f"Error fetching activities: {e}")
+        print(f"Error fetching activities for {current_stage}: {e}")
         activities = [{"type": "discussion", "title": f"Default activity for {current_stage}"}]
 
-    approved = []
-    for activity in activities:
-        print(f"- {activity.get('type', 'Unknown')}: {activity.get('title', 'No title')}")
-        ans = input("Approve this activity? (y/n) [y]: ").strip().lower()
-        if ans != "n":
-            approved.append(activity)
+    # Runs in parallel with the other stages; the reducer merges this fragment in
+    return {"proposed_activities": {current_stage: activities}}
 
-    current_activities = dict(state.get("stage_activities", {}))
-    current_activities[current_stage] = approved
-    return {**state, "stage_activities": current_activities}
+
+def stage2_approve_activities(state: State) -> State:
+    """HITL approval of every proposed activity once all stages are fetched"""
+    proposed = state.get("proposed_activities", {})
+    approved_by_stage: Dict[str, List[Dict[str, Any]]] = {}
+    for stage in state.get("template_stages", []):
+        print(f"\n=== POPULATING STAGE: {stage} ===")
+        approved = []
+        for activity in proposed.get(stage, []):
+            print(f"- {activity.get('type', 'Unknown')}: {activity.get('title', 'No title')}")
+            ans = input("Approve this activity? (y/n) [y]: ").strip().lower()
+            if ans != "n":
+                approved.append(activity)
+        approved_by_stage[stage] = approved
+
+    return {"stage_activities": approved_by_stage}
 
 
-def stage2_next_stage(state: State) -> State:
-    stages = state.get("template_stages", [])
-    current_stage = state.get("current_stage")
-    if current_stage and current_stage in stages:
-        idx = stages.index(current_stage)
-        if idx < len(stages) - 1:
-            return {**state, "current_stage": stages[idx + 1]}
-    return {**state, "current_stage": None}
- 
- 
 # ===== STAGE 3 =====
 def stage3_check_completion(state: State) -> State:
     stages = state.get("template_stages", [])
     activities = state.get("stage_activities", {})
     complete = bool(stages) and all(stage in activities and activities[stage] for stage in stages)
-    return {**state, "is_complete": complete}
+    return {"is_complete": complete}
 
 
 def stage3_generate_output(state: State) -> State:
@@ -240,11 +468,13 @@ def stage3_generate_output(state: State) -> State:
             "slos": state.get("slos"),
         },
     }
-    return {**state, "final_output": output}
+    return {"final_output": output}
 
 
 # ===== BUILD WORKFLOW =====
+@lru_cache(maxsize=1)
 def create_main_workflow():
+    """Build and compile the workflow graph once; callers share the compiled graph"""
     builder = StateGraph(State)
 
     # Stage 1
@@ -258,9 +488,9 @@ def create_main_workflow():
     # Stage 2
     builder.add_node("stage2_template_approval", stage2_template_approval)
     builder.add_node("stage2_template_adjustment", stage2_template_adjustment)
-    builder.add_node("stage2_prepare_stages", stage2_prepare_stages)
+    builder.add_node("stage2_fetch_all_activities", stage2_fetch_all_activities)
     builder.add_node("stage2_populate_stage", stage2_populate_stage)
-    builder.add_node("stage2_next_stage", stage2_next_stage)
+    builder.add_node("stage2_approve_activities", stage2_approve_activities)
 
     # Stage 3
     builder.add_node("stage3_check_completion", stage3_check_completion)
@@ -273,18 +503,14 @@ def create_main_workflow():
 
     builder.add_edge("init_template", "stage2_template_approval")
     builder.add_edge("stage2_template_approval", "stage2_template_adjustment")
-    builder.add_edge("stage2_template_adjustment", "stage2_prepare_stages")
-    builder.add_edge("stage2_prepare_stages", "stage2_populate_stage")
-    builder.add_edge("stage2_populate_stage", "stage2_next_stage")
-
-    def should_continue_stages(state: State) -> str:
-        return "continue" if state.get("current_stage") else "complete"
-
+    builder.add_edge("stage2_template_adjustment", "stage2_fetch_all_activities")
     builder.add_conditional_edges(
-        "stage2_next_stage",
-        should_continue_stages,
-        {"continue": "stage2_populate_stage", "complete": "stage3_check_completion"},
+        "stage2_fetch_all_activities",
+        stage2_dispatch_stages,
+        ["stage2_populate_stage", "stage2_approve_activities"],
     )
+    builder.add_edge("stage2_populate_stage", "stage2_approve_activities")
+    builder.add_edge("stage2_approve_activities", "stage3_check_completion")
 
     builder.add_edge("stage3_check_completion", "stage3_generate_output")
     builder.add_edge("stage3_generate_output", END)
@@ -316,6 +542,9 @@ if __name__ == "__main__":
         "final_output": None,
     }
 
-    result = workflow.invoke(initial_state)
+    # Under ainvoke LangGraph runs sync nodes in its executor, so HTTP calls and input()
+    # prompts never block the event loop shared with other workflow runs
+    run = uvloop.run if uvloop is not None else asyncio.run
+    result = run(workflow.ainvoke(initial_state))
     print("\nWorkflow completed!")
     print("Final output:", result["final_output"])
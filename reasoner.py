@@ -1,7 +1,133 @@
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Mapping, NamedTuple, Sequence, Tuple, Type, TypeVar
+from collections import OrderedDict
+import hashlib
 import json
+import logging
+import os
 import random
-from datetime import datetime
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from functools import lru_cache, wraps
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on shared stage contexts kept for /activities/propose lookups
+CONTEXT_STORE_SIZE = 1024
+# Upper bound on memoized endpoint responses
+RESPONSE_CACHE_SIZE = 2048
+# Upper bound on memoized template score rows
+SCORE_CACHE_SIZE = 1024
+# On-disk LLM response cache shared across restarts; set EDTECK_LLM_CACHE="" to disable
+LLM_CACHE_PATH = os.environ.get("EDTECK_LLM_CACHE", os.path.join("~", ".edteck_cache", "llm_cache.sqlite3"))
+LLM_CACHE_SIZE_LIMIT = 256 << 20
+# Bump whenever the canned responses change so persisted entries are not reused
+_CACHE_VERSION = 1
+
+def _fast_isoformat(ns: int) -> str:
+    """Local-time ISO 8601 string matching datetime.now().isoformat(), without building a datetime"""
+    secs, rem = divmod(ns, 1_000_000_000)
+    tm = time.localtime(secs)
+    micros = rem // 1000
+    stamp = f"{tm.tm_year:04d}-{tm.tm_mon:02d}-{tm.tm_mday:02d}T{tm.tm_hour:02d}:{tm.tm_min:02d}:{tm.tm_sec:02d}"
+    return f"{stamp}.{micros:06d}" if micros else stamp
+
+# Prompt categories MockLLM knows how to answer, in match priority order
+_PROMPT_KEYS = ("context_analysis", "template_recommendation", "activity_suggestion", "stage_optimization")
+# Context fields the canned responses draw on; the memo key is built from these only
+_PROMPT_CONTEXT_FIELDS = ("subject", "grade", "stage", "pre_slos")
+_DEFAULT_RESPONSE = "I recommend a personalized approach based on the student's needs and learning objectives."
+
+# Canned response format strings and the defaults used for fields missing from the context
+_RESPONSE_FORMATS = {
+    "context_analysis": (
+        "Student shows strong interest in {subject} with {grade} grade level understanding.",
+        {"subject": "science", "grade": "8th"}
+    ),
+    "template_recommendation": (
+        "Based on the student's {grade} grade level and {subject} focus, I recommend the 5E template for its structured approach.",
+        {"grade": "8th", "subject": "science"}
+    ),
+    "activity_suggestion": (
+        "For the {stage} stage, I suggest interactive activities that build on the student's {pre_slos} knowledge.",
+        {"stage": "Engage", "pre_slos": ["basic concepts"]}
+    ),
+    "stage_optimization": (
+        "The {stage} stage should be adapted to accommodate the student's learning pace and interests.",
+        {"stage": "current"}
+    )
+}
+
+class _DiskCache:
+    """sqlite-backed key/value store that keeps responses across restarts"""
+    
+    def __init__(self, path: str, size_limit: int):
+        self.path = os.path.expanduser(path) if path else ""
+        self.size_limit = size_limit
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+    
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        # Connections are opened lazily and per process so forked workers never share one
+        if self._pid == os.getpid():
+            return self._conn
+        self._pid = os.getpid()
+        self._conn = None
+        if not self.path:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+            conn.execute(f"PRAGMA max_page_count={self.size_limit // page_size}")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        except (OSError, sqlite3.Error):
+            # An unusable cache location just means no persistence
+            return None
+        self._conn = conn
+        return conn
+    
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return None
+            try:
+                row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+            except sqlite3.Error:
+                return None
+        return row[0] if row else None
+    
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return
+            try:
+                conn.execute("INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)", (key, value))
+            except sqlite3.Error:
+                # Full or locked; the in-memory tier still has the value
+                pass
+
+_DISK_CACHE = _DiskCache(LLM_CACHE_PATH, LLM_CACHE_SIZE_LIMIT)
+
+@lru_cache(maxsize=4096)
+def _cached_generate(prompt_key: str, ctx_key: str) -> str:
+    """Render the canned response for a prompt category; memoized in memory, then on disk"""
+    disk_key = hashlib.blake2b(
+        f"{_CACHE_VERSION}\0{prompt_key}\0{ctx_key}".encode(), digest_size=16
+    ).hexdigest()
+    response = _DISK_CACHE.get(disk_key)
+    if response is None:
+        response_format, defaults = _RESPONSE_FORMATS[prompt_key]
+        response = response_format.format_map({**defaults, **json.loads(ctx_key)})
+        _DISK_CACHE.set(disk_key, response)
+    return response
 
 # Mock LLM responses - in a real implementation, you'd use OpenAI, Anthropic, or similar
 class MockLLM:
@@ -11,19 +137,256 @@ class MockLLM:
     def generate_response(prompt: str, context: Dict[str, Any] = None) -> str:
         """Generate a mock LLM response based on the prompt and context"""
         # In a real implementation, this would call an actual LLM API
-        responses = {
-            "context_analysis": f"Student shows strong interest in {context.get('subject', 'science')} with {context.get('grade', '8th')} grade level understanding.",
-            "template_recommendation": f"Based on the student's {context.get('grade', '8th')} grade level and {context.get('subject', 'science')} focus, I recommend the 5E template for its structured approach.",
-            "activity_suggestion": f"For the {context.get('stage', 'Engage')} stage, I suggest interactive activities that build on the student's {context.get('pre_slos', ['basic concepts'])} knowledge.",
-            "stage_optimization": f"The {context.get('stage', 'current')} stage should be adapted to accommodate the student's learning pace and interests."
-        }
-        
-        # Find the best matching response type
-        for key, response in responses.items():
-            if key in prompt.lower():
-                return response
+        prompt_lower = prompt.lower()
+        prompt_key = next((k for k in _PROMPT_KEYS if k in prompt_lower), None)
+        if prompt_key is None:
+            return _DEFAULT_RESPONSE
         
-        return "I recommend a personalized approach based on the student's needs and learning objectives."
+        # Only fields present in the context go into the key so missing ones keep their defaults
+        context = context or {}
+        ctx_key = json.dumps(
+            {k: context[k] for k in _PROMPT_CONTEXT_FIELDS if k in context},
+            sort_keys=True, default=str
+        )
+        return _cached_generate(prompt_key, ctx_key)
+
+# Available lesson plan templates, built once at import
+_TEMPLATES = {
+    "5e": {
+        "name": "5E Instructional Model",
+        "description": "Engage, Explore, Explain, Elaborate, Evaluate",
+        "stages": ["Engage", "Explore", "Explain", "Elaborate", "Evaluate"],
+        "best_for": ["Science", "Mathematics", "Inquiry-based learning"],
+        "confidence_factors": ["student_engagement", "hands_on_learning", "conceptual_understanding"]
+    },
+    "7e": {
+        "name": "7E Instructional Model", 
+        "description": "Elicit, Engage, Explore, Explain, Elaborate, Evaluate, Extend",
+        "stages": ["Elicit", "Engage", "Explore", "Explain", "Elaborate", "Evaluate", "Extend"],
+        "best_for": ["Advanced science", "Complex concepts", "Extended learning"],
+        "confidence_factors": ["prior_knowledge", "advanced_learning", "comprehensive_coverage"]
+    },
+    "pbl": {
+        "name": "Problem-Based Learning",
+        "description": "Challenge, Investigate, Create, Debrief",
+        "stages": ["Challenge", "Investigate", "Create", "Debrief"],
+        "best_for": ["Real-world applications", "Critical thinking", "Collaborative learning"],
+        "confidence_factors": ["problem_solving", "collaboration", "real_world_relevance"]
+    },
+    "dynamic": {
+        "name": "Dynamic Learning Model",
+        "description": "Adaptive stages based on student progress",
+        "stages": ["Assess", "Adapt", "Implement", "Review"],
+        "best_for": ["Personalized learning", "Adaptive instruction", "Student-paced learning"],
+        "confidence_factors": ["personalization", "adaptability", "student_agency"]
+    }
+}
+
+# recommend_template bonuses per template, keyed by grade tag (in match priority order) and SLO count bucket
+_GRADE_BONUS = {"8th": {"7e": 0.3, "pbl": 0.3}, "7th": {"5e": 0.3, "dynamic": 0.3}}
+_SLO_BONUS = {"hi": {"7e": 0.2, "pbl": 0.2}, "lo": {"5e": 0.2, "dynamic": 0.2}}
+
+# Student record fields holding repeated categorical strings, and list fields frozen to tuples
+_INTERNED_FIELDS = frozenset({"grade", "subject", "learning_style", "performance", "topic"})
+_TUPLE_FIELDS = frozenset({"interests", "strengths", "challenges", "slos", "pre_slos"})
+
+def _compact_record(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Intern categorical strings and turn list fields into tuples so records share storage"""
+    compact = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            value = _compact_record(value)
+        elif key == "learning_history":
+            value = tuple(_compact_record(event) for event in value)
+        elif key in _TUPLE_FIELDS:
+            value = tuple(sys.intern(item) for item in value)
+        elif key in _INTERNED_FIELDS and isinstance(value, str):
+            value = sys.intern(value)
+        compact[key] = value
+    return compact
+
+# Mock student database, built once at import
+_STUDENT_DATABASE = {
+    "student_123": {
+        "student_info": {
+            "name": "Alex Johnson",
+            "age": 13,
+            "learning_style": "visual",
+            "interests": ["robotics", "space", "experiments"],
+            "strengths": ["problem_solving", "creativity"],
+            "challenges": ["reading_comprehension", "time_management"]
+        },
+        "grade": "8th",
+        "subject": "Science",
+        "slos": [
+            "Understand the scientific method",
+            "Analyze experimental data",
+            "Apply scientific principles to real-world problems"
+        ],
+        "pre_slos": [
+            "Basic scientific observation",
+            "Simple experimental procedures",
+            "Data collection and recording"
+        ],
+        "learning_history": [
+            {"topic": "Chemistry basics", "performance": "excellent", "date": "2024-01-15"},
+            {"topic": "Physics fundamentals", "performance": "good", "date": "2024-02-01"}
+        ]
+    },
+    "student_456": {
+        "student_info": {
+            "name": "Sam Rivera",
+            "age": 12,
+            "learning_style": "kinesthetic",
+            "interests": ["sports", "music", "hands_on_projects"],
+            "strengths": ["practical_application", "teamwork"],
+            "challenges": ["theoretical_concepts", "independent_work"]
+        },
+        "grade": "7th",
+        "subject": "Mathematics",
+        "slos": [
+            "Solve algebraic equations",
+            "Apply geometric principles",
+            "Use mathematical reasoning"
+        ],
+        "pre_slos": [
+            "Basic arithmetic operations",
+            "Simple geometric shapes",
+            "Pattern recognition"
+        ],
+        "learning_history": [
+            {"topic": "Pre-algebra", "performance": "good", "date": "2024-01-20"},
+            {"topic": "Geometry basics", "performance": "excellent", "date": "2024-02-10"}
+        ]
+    }
+}
+
+_STUDENT_DATABASE = {student_id: _compact_record(record) for student_id, record in _STUDENT_DATABASE.items()}
+
+# Stage-specific activity tables, shared read-only by every proposal
+_STAGE_ACTIVITIES = MappingProxyType({
+    "engage": (
+        MappingProxyType({
+            "type": "discussion",
+            "title": "Hook Discussion",
+            "description": "Start with an intriguing question or real-world scenario",
+            "duration": "10-15 minutes",
+            "materials": ("Discussion prompts", "Visual aids"),
+            "adaptations": ("Group discussion", "Individual reflection", "Interactive polling")
+        }),
+        MappingProxyType({
+            "type": "video",
+            "title": "Inspirational Video",
+            "description": "Show a short video related to the topic",
+            "duration": "5-8 minutes",
+            "materials": ("Video content", "Discussion questions"),
+            "adaptations": ("Pause for discussion", "Note-taking", "Predictions")
+        })
+    ),
+    "explore": (
+        MappingProxyType({
+            "type": "hands_on",
+            "title": "Guided Investigation",
+            "description": "Students explore concepts through hands-on activities",
+            "duration": "20-30 minutes",
+            "materials": ("Lab materials", "Safety equipment", "Worksheets"),
+            "adaptations": ("Partner work", "Individual exploration", "Station rotation")
+        }),
+        MappingProxyType({
+            "type": "simulation",
+            "title": "Digital Simulation",
+            "description": "Use computer simulations to explore concepts",
+            "duration": "15-25 minutes",
+            "materials": ("Computer/tablet", "Simulation software"),
+            "adaptations": ("Individual work", "Small groups", "Whole class demonstration")
+        })
+    ),
+    "explain": (
+        MappingProxyType({
+            "type": "lecture",
+            "title": "Concept Explanation",
+            "description": "Teacher explains key concepts with examples",
+            "duration": "15-20 minutes",
+            "materials": ("Presentation slides", "Examples", "Visual aids"),
+            "adaptations": ("Interactive lecture", "Student questions", "Real-time examples")
+        }),
+        MappingProxyType({
+            "type": "reading",
+            "title": "Text Analysis",
+            "description": "Students read and analyze relevant text",
+            "duration": "20-25 minutes",
+            "materials": ("Reading materials", "Highlighters", "Note-taking tools"),
+            "adaptations": ("Individual reading", "Partner reading", "Group discussion")
+        })
+    ),
+    "elaborate": (
+        MappingProxyType({
+            "type": "project",
+            "title": "Extended Project",
+            "description": "Students apply concepts in a longer project",
+            "duration": "45-60 minutes",
+            "materials": ("Project materials", "Guidelines", "Assessment rubrics"),
+            "adaptations": ("Individual projects", "Group projects", "Choice of project type")
+        }),
+        MappingProxyType({
+            "type": "application",
+            "title": "Real-world Application",
+            "description": "Apply concepts to real-world scenarios",
+            "duration": "30-40 minutes",
+            "materials": ("Case studies", "Problem scenarios", "Research tools"),
+            "adaptations": ("Individual work", "Partner collaboration", "Class presentation")
+        })
+    ),
+    "evaluate": (
+        MappingProxyType({
+            "type": "assessment",
+            "title": "Formative Assessment",
+            "description": "Check student understanding through various methods",
+            "duration": "20-30 minutes",
+            "materials": ("Assessment tools", "Feedback forms", "Rubrics"),
+            "adaptations": ("Individual assessment", "Peer assessment", "Self-assessment")
+        }),
+        MappingProxyType({
+            "type": "reflection",
+            "title": "Learning Reflection",
+            "description": "Students reflect on their learning journey",
+            "duration": "15-20 minutes",
+            "materials": ("Reflection prompts", "Journal entries", "Discussion questions"),
+            "adaptations": ("Written reflection", "Oral reflection", "Creative reflection")
+        })
+    )
+})
+
+# Shared stand-in for a missing or null student_info, so lookups never allocate a fresh dict
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+
+class _Ctx(NamedTuple):
+    """Stage context fields the service reads, resolved once with their defaults"""
+    grade: str = ""
+    subject: str = ""
+    slos: Sequence[str] = ()
+    pre_slos: Sequence[str] = ()
+    student_info: Mapping[str, Any] = _EMPTY
+    stage: str = ""
+
+_CTX_DEFAULTS = tuple(_Ctx._field_defaults.items())
+
+def _to_ctx(context: Mapping[str, Any]) -> _Ctx:
+    """Pull the context fields out once; missing or null fields take their defaults"""
+    return _Ctx._make(context.get(field) or default for field, default in _CTX_DEFAULTS)
+
+# Extra material added to every activity for a student's learning style
+_STYLE_MATERIAL = {"visual": "Visual aids", "kinesthetic": "Hands-on materials"}
+
+# Generic activity for stages without a dedicated table; title and description are per stage
+_GENERIC_STAGE_ACTIVITY = {
+    "type": "discussion",
+    "title": "{stage} Stage Activity",
+    "description": "Customized activity for the {stage} stage",
+    "duration": "20-25 minutes",
+    "materials": ("Activity materials", "Instructions"),
+    "adaptations": ("Individual work", "Group work", "Whole class")
+}
 
 class ReasonerService:
     """Main reasoner service that handles all API endpoints"""
@@ -31,99 +394,27 @@ class ReasonerService:
     def __init__(self):
         self.llm = MockLLM()
         self.templates = self._initialize_templates()
+        # Templates keyed by each interned, lowercased best_for subject, built once so scoring
+        # never lowercases the catalog; kept out of the template dicts so it never reaches responses
+        best_for_index: Dict[str, set] = {}
+        for name, template in self.templates.items():
+            for subject in template["best_for"]:
+                best_for_index.setdefault(sys.intern(subject.lower()), set()).add(name)
+        self.templates_by_subject = {subject: frozenset(names) for subject, names in best_for_index.items()}
+        self._score_templates = lru_cache(maxsize=SCORE_CACHE_SIZE)(self._score_templates_uncached)
         self.student_database = self._initialize_student_database()
+        self.context_store: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._context_store_lock = threading.Lock()
     
     def _initialize_templates(self) -> Dict[str, Dict[str, Any]]:
         """Initialize available lesson plan templates"""
-        return {
-            "5e": {
-                "name": "5E Instructional Model",
-                "description": "Engage, Explore, Explain, Elaborate, Evaluate",
-                "stages": ["Engage", "Explore", "Explain", "Elaborate", "Evaluate"],
-                "best_for": ["Science", "Mathematics", "Inquiry-based learning"],
-                "confidence_factors": ["student_engagement", "hands_on_learning", "conceptual_understanding"]
-            },
-            "7e": {
-                "name": "7E Instructional Model", 
-                "description": "Elicit, Engage, Explore, Explain, Elaborate, Evaluate, Extend",
-                "stages": ["Elicit", "Engage", "Explore", "Explain", "Elaborate", "Evaluate", "Extend"],
-                "best_for": ["Advanced science", "Complex concepts", "Extended learning"],
-                "confidence_factors": ["prior_knowledge", "advanced_learning", "comprehensive_coverage"]
-            },
-            "pbl": {
-                "name": "Problem-Based Learning",
-                "description": "Challenge, Investigate, Create, Debrief",
-                "stages": ["Challenge", "Investigate", "Create", "Debrief"],
-                "best_for": ["Real-world applications", "Critical thinking", "Collaborative learning"],
-                "confidence_factors": ["problem_solving", "collaboration", "real_world_relevance"]
-            },
-            "dynamic": {
-                "name": "Dynamic Learning Model",
-                "description": "Adaptive stages based on student progress",
-                "stages": ["Assess", "Adapt", "Implement", "Review"],
-                "best_for": ["Personalized learning", "Adaptive instruction", "Student-paced learning"],
-                "confidence_factors": ["personalization", "adaptability", "student_agency"]
-            }
-        }
+        return _TEMPLATES
     
     def _initialize_student_database(self) -> Dict[str, Dict[str, Any]]:
         """Initialize mock student database"""
-        return {
-            "student_123": {
-                "student_info": {
-                    "name": "Alex Johnson",
-                    "age": 13,
-                    "learning_style": "visual",
-                    "interests": ["robotics", "space", "experiments"],
-                    "strengths": ["problem_solving", "creativity"],
-                    "challenges": ["reading_comprehension", "time_management"]
-                },
-                "grade": "8th",
-                "subject": "Science",
-                "slos": [
-                    "Understand the scientific method",
-                    "Analyze experimental data",
-                    "Apply scientific principles to real-world problems"
-                ],
-                "pre_slos": [
-                    "Basic scientific observation",
-                    "Simple experimental procedures",
-                    "Data collection and recording"
-                ],
-                "learning_history": [
-                    {"topic": "Chemistry basics", "performance": "excellent", "date": "2024-01-15"},
-                    {"topic": "Physics fundamentals", "performance": "good", "date": "2024-02-01"}
-                ]
-            },
-            "student_456": {
-                "student_info": {
-                    "name": "Sam Rivera",
-                    "age": 12,
-                    "learning_style": "kinesthetic",
-                    "interests": ["sports", "music", "hands_on_projects"],
-                    "strengths": ["practical_application", "teamwork"],
-                    "challenges": ["theoretical_concepts", "independent_work"]
-                },
-                "grade": "7th",
-                "subject": "Mathematics",
-                "slos": [
-                    "Solve algebraic equations",
-                    "Apply geometric principles",
-                    "Use mathematical reasoning"
-                ],
-                "pre_slos": [
-                    "Basic arithmetic operations",
-                    "Simple geometric shapes",
-                    "Pattern recognition"
-                ],
-                "learning_history": [
-                    {"topic": "Pre-algebra", "performance": "good", "date": "2024-01-20"},
-                    {"topic": "Geometry basics", "performance": "excellent", "date": "2024-02-10"}
-                ]
-            }
-        }
+        return _STUDENT_DATABASE
     
-    def fetch_context(self, student_id: str) -> Dict[str, Any]:
+    def fetch_context(self, student_id: str, timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Fetch student context and learning information"""
         if student_id not in self.student_database:
             raise ValueError(f"Student {student_id} not found")
@@ -142,55 +433,58 @@ class ReasonerService:
             "pre_slos": student_data["pre_slos"],
             "learning_history": student_data["learning_history"],
             "llm_analysis": llm_analysis,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp or _fast_isoformat(time.time_ns())
         }
     
-    def recommend_template(self, context: Dict[str, Any]) -> Dict[str, Any]:
+    def recommend_template(self, context: Dict[str, Any], timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Recommend the best lesson plan template based on student context"""
-        grade = context.get("grade", "")
-        subject = context.get("subject", "")
-        slos = context.get("slos", [])
-        pre_slos = context.get("pre_slos", [])
+        ctx = _to_ctx(context)
         
         # Use LLM to generate recommendation
-        recommendation_prompt = f"Recommend a lesson plan template for {grade} grade {subject} with SLOs: {slos}"
+        recommendation_prompt = f"Recommend a lesson plan template for {ctx.grade} grade {ctx.subject} with SLOs: {ctx.slos}"
         llm_recommendation = self.llm.generate_response(recommendation_prompt, context)
         
-        # Calculate confidence scores for each template
-        template_scores = {}
-        for template_name, template_info in self.templates.items():
-            score = 0
-            
-            # Grade level compatibility
-            if "8th" in grade and template_name in ["7e", "pbl"]:
-                score += 0.3
-            elif "7th" in grade and template_name in ["5e", "dynamic"]:
-                score += 0.3
-            
-            # Subject compatibility
-            if subject.lower() in [s.lower() for s in template_info["best_for"]]:
-                score += 0.4
-            
-            # SLO complexity matching
-            if len(slos) > 3 and template_name in ["7e", "pbl"]:
-                score += 0.2
-            elif len(slos) <= 3 and template_name in ["5e", "dynamic"]:
-                score += 0.2
-            
-            template_scores[template_name] = min(score, 1.0)
-        
-        # Find best template
-        best_template = max(template_scores.items(), key=lambda x: x[1])
+        # Scores depend only on the grade tags present, the subject and the SLO bucket,
+        # so the scoring pass runs once per distinct combination
+        grade_tags = tuple(tag for tag in _GRADE_BONUS if tag in ctx.grade)
+        scores, best_name, best_score = self._score_templates(grade_tags, ctx.subject.lower(), len(ctx.slos) > 3)
+        template_scores = dict(scores)
         
         return {
-            "template": best_template[0].upper(),
-            "confidence": round(best_template[1], 2),
+            "template": best_name.upper(),
+            "confidence": round(best_score, 2),
             "rationale": llm_recommendation,
             "all_scores": template_scores,
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp or _fast_isoformat(time.time_ns())
         }
     
-    def fetch_template(self, template_name: str) -> Dict[str, Any]:
+    def _score_templates_uncached(self, grade_tags: Tuple[str, ...], subj_lc: str,
+                                  many_slos: bool) -> Tuple[Tuple[Tuple[str, float], ...], str, float]:
+        """Score every template from the bonus tables and pick the best one"""
+        # Earlier grade tags win, so merge them last
+        grade_bonus = {}
+        for tag in reversed(grade_tags):
+            grade_bonus.update(_GRADE_BONUS[tag])
+        slo_bonus = _SLO_BONUS["hi" if many_slos else "lo"]
+        subject_matches = self.templates_by_subject.get(subj_lc, frozenset())
+        
+        template_scores = dict.fromkeys(self.templates, 0.0)
+        best_name, best_score = "5e", -1.0
+        for template_name in template_scores:
+            score = (
+                grade_bonus.get(template_name, 0)
+                + (0.4 if template_name in subject_matches else 0)
+                + slo_bonus.get(template_name, 0)
+            )
+            score = min(score, 1.0)
+            template_scores[template_name] = score
+            # Track the best template as we go; ties keep the earlier one
+            if score > best_score:
+                best_name, best_score = template_name, score
+        
+        return tuple(template_scores.items()), best_name, best_score
+    
+    def fetch_template(self, template_name: str, timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Fetch template definition and metadata"""
         template_key = template_name.lower()
         if template_key not in self.templates:
@@ -215,189 +509,290 @@ class ReasonerService:
                 "Summative assessment at completion",
                 "Student self-reflection and peer feedback"
             ],
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp or _fast_isoformat(time.time_ns())
         }
     
-    def propose_activities(self, stage: str, context: Dict[str, Any]) -> Dict[str, Any]:
+    def cache_context(self, context: Dict[str, Any]) -> str:
+        """Store a stage context shared by several proposals and return its id"""
+        context_id = uuid.uuid4().hex
+        with self._context_store_lock:
+            self.context_store[context_id] = context
+            while len(self.context_store) > CONTEXT_STORE_SIZE:
+                self.context_store.popitem(last=False)
+        return context_id
+    
+    def get_cached_context(self, context_id: str) -> Optional[Dict[str, Any]]:
+        """Look up a stored stage context, or None if it is unknown or evicted"""
+        with self._context_store_lock:
+            return self.context_store.get(context_id)
+    
+    def propose_activities(self, stage: str, context: Dict[str, Any], timestamp: Optional[str] = None) -> Dict[str, Any]:
         """Propose activities for a specific stage based on student context"""
-        grade = context.get("grade", "")
-        subject = context.get("subject", "")
-        slos = context.get("slos", [])
-        student_info = context.get("student_info", {})
+        ctx = _to_ctx(context)
+        student_info = ctx.student_info
         
         # Use LLM to generate activity suggestions
-        activity_prompt = f"Suggest activities for the {stage} stage in {grade} grade {subject}"
+        activity_prompt = f"Suggest activities for the {stage} stage in {ctx.grade} grade {ctx.subject}"
         llm_suggestions = self.llm.generate_response(activity_prompt, context)
         
         # Generate stage-specific activities
-        stage_activities = self._generate_stage_activities(stage, context)
+        stage_activities = self._generate_stage_activities(stage, ctx)
         
         return {
             "stage": stage,
             "activities": stage_activities,
             "llm_suggestions": llm_suggestions,
             "context_considerations": {
-                "grade_level": grade,
-                "subject_focus": subject,
+                "grade_level": ctx.grade,
+                "subject_focus": ctx.subject,
                 "learning_style": student_info.get("learning_style", "unknown"),
                 "student_interests": student_info.get("interests", [])
             },
-            "timestamp": datetime.now().isoformat()
+            "timestamp": timestamp or _fast_isoformat(time.time_ns())
         }
     
-    def _generate_stage_activities(self, stage: str, context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    def propose_activities_batch(self, stages: List[str], context: Dict[str, Any], timestamp: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Propose activities for several stages that share one student context"""
+        timestamp = timestamp or _fast_isoformat(time.time_ns())
+        return {stage: self.propose_activities(stage, {**context, "stage": stage}, timestamp) for stage in stages}
+    
+    def _generate_stage_activities(self, stage: str, ctx: _Ctx) -> Sequence[Mapping[str, Any]]:
         """Generate specific activities for a given stage"""
-        activities = []
-        
-        if stage.lower() == "engage":
-            activities = [
-                {
-                    "type": "discussion",
-                    "title": "Hook Discussion",
-                    "description": "Start with an intriguing question or real-world scenario",
-                    "duration": "10-15 minutes",
-                    "materials": ["Discussion prompts", "Visual aids"],
-                    "adaptations": ["Group discussion", "Individual reflection", "Interactive polling"]
-                },
-                {
-                    "type": "video",
-                    "title": "Inspirational Video",
-                    "description": "Show a short video related to the topic",
-                    "duration": "5-8 minutes",
-                    "materials": ["Video content", "Discussion questions"],
-                    "adaptations": ["Pause for discussion", "Note-taking", "Predictions"]
-                }
-            ]
-        elif stage.lower() == "explore":
-            activities = [
-                {
-                    "type": "hands_on",
-                    "title": "Guided Investigation",
-                    "description": "Students explore concepts through hands-on activities",
-                    "duration": "20-30 minutes",
-                    "materials": ["Lab materials", "Safety equipment", "Worksheets"],
-                    "adaptations": ["Partner work", "Individual exploration", "Station rotation"]
-                },
-                {
-                    "type": "simulation",
-                    "title": "Digital Simulation",
-                    "description": "Use computer simulations to explore concepts",
-                    "duration": "15-25 minutes",
-                    "materials": ["Computer/tablet", "Simulation software"],
-                    "adaptations": ["Individual work", "Small groups", "Whole class demonstration"]
-                }
-            ]
-        elif stage.lower() == "explain":
-            activities = [
-                {
-                    "type": "lecture",
-                    "title": "Concept Explanation",
-                    "description": "Teacher explains key concepts with examples",
-                    "duration": "15-20 minutes",
-                    "materials": ["Presentation slides", "Examples", "Visual aids"],
-                    "adaptations": ["Interactive lecture", "Student questions", "Real-time examples"]
-                },
-                {
-                    "type": "reading",
-                    "title": "Text Analysis",
-                    "description": "Students read and analyze relevant text",
-                    "duration": "20-25 minutes",
-                    "materials": ["Reading materials", "Highlighters", "Note-taking tools"],
-                    "adaptations": ["Individual reading", "Partner reading", "Group discussion"]
-                }
-            ]
-        elif stage.lower() == "elaborate":
-            activities = [
-                {
-                    "type": "project",
-                    "title": "Extended Project",
-                    "description": "Students apply concepts in a longer project",
-                    "duration": "45-60 minutes",
-                    "materials": ["Project materials", "Guidelines", "Assessment rubrics"],
-                    "adaptations": ["Individual projects", "Group projects", "Choice of project type"]
-                },
-                {
-                    "type": "application",
-                    "title": "Real-world Application",
-                    "description": "Apply concepts to real-world scenarios",
-                    "duration": "30-40 minutes",
-                    "materials": ["Case studies", "Problem scenarios", "Research tools"],
-                    "adaptations": ["Individual work", "Partner collaboration", "Class presentation"]
-                }
-            ]
-        elif stage.lower() == "evaluate":
-            activities = [
-                {
-                    "type": "assessment",
-                    "title": "Formative Assessment",
-                    "description": "Check student understanding through various methods",
-                    "duration": "20-30 minutes",
-                    "materials": ["Assessment tools", "Feedback forms", "Rubrics"],
-                    "adaptations": ["Individual assessment", "Peer assessment", "Self-assessment"]
-                },
-                {
-                    "type": "reflection",
-                    "title": "Learning Reflection",
-                    "description": "Students reflect on their learning journey",
-                    "duration": "15-20 minutes",
-                    "materials": ["Reflection prompts", "Journal entries", "Discussion questions"],
-                    "adaptations": ["Written reflection", "Oral reflection", "Creative reflection"]
-                }
-            ]
-        else:
+        activities = _STAGE_ACTIVITIES.get(stage.lower())
+        if activities is None:
             # Generic activity for other stages
-            activities = [
-                {
-                    "type": "discussion",
-                    "title": f"{stage} Stage Activity",
-                    "description": f"Customized activity for the {stage} stage",
-                    "duration": "20-25 minutes",
-                    "materials": ["Activity materials", "Instructions"],
-                    "adaptations": ["Individual work", "Group work", "Whole class"]
-                }
-            ]
-        
-        # Customize activities based on student context
-        for activity in activities:
-            if context.get("student_info", {}).get("learning_style") == "visual":
-                activity["materials"].append("Visual aids")
-            elif context.get("student_info", {}).get("learning_style") == "kinesthetic":
-                activity["materials"].append("Hands-on materials")
+            activities = [{
+                **_GENERIC_STAGE_ACTIVITY,
+                "title": _GENERIC_STAGE_ACTIVITY["title"].format(stage=stage),
+                "description": _GENERIC_STAGE_ACTIVITY["description"].format(stage=stage)
+            }]
         
+        # Customize activities based on student context; the shared tables are returned as-is otherwise
+        style = ctx.student_info.get("learning_style")
+        extra = _STYLE_MATERIAL.get(style)
+        if extra:
+            return [{**activity, "materials": activity["materials"] + (extra,)} for activity in activities]
         return activities
 
 # ===== FLASK API SERVER =====
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+# POST /context                 - Fetch student context
+# POST /context/cache           - Store a shared stage context
+# POST /template/recommend      - Recommend template
+# GET  /templates/<name>        - Fetch template
+# POST /activities/propose      - Propose activities
+# POST /activities/propose_batch - Propose activities for several stages
+# GET  /health                  - Health check
+import orjson
+from flask import Flask, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+
+def _json_default(o: Any) -> Any:
+    """Encode the read-only activity tables, deferring to Flask for everything else"""
+    if isinstance(o, MappingProxyType):
+        return dict(o)
+    return DefaultJSONProvider.default(o)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider that encodes and decodes with orjson"""
+    
+    default = staticmethod(_json_default)
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
 
 app = Flask(__name__)
-CORS(app)
+app.json = OrjsonProvider(app)
+
+# Fixed CORS policy: any origin may call the JSON endpoints
+_CORS_HEADERS = (
+    ("Access-Control-Allow-Origin", "*"),
+    ("Access-Control-Allow-Methods", "GET,POST,OPTIONS"),
+    ("Access-Control-Allow-Headers", "Content-Type"),
+)
+
+@app.before_request
+def _cors_preflight():
+    """Answer every CORS preflight with 204; the headers are added in _cors"""
+    if request.method == "OPTIONS":
+        return app.response_class(status=204)
+
+@app.after_request
+def _cors(response):
+    """Attach the CORS headers to every response"""
+    response.headers.extend(_CORS_HEADERS)
+    return response
+
+def _request_timestamp() -> str:
+    """Timestamp for the current request, computed on first use and shared by everything it returns"""
+    ts = g.get("req_ts")
+    if ts is None:
+        ts = g.req_ts = _fast_isoformat(time.time_ns())
+    return ts
+
+def _json_response(obj: Any) -> Any:
+    """Encode a large payload straight to an orjson bytes response, skipping jsonify"""
+    return app.response_class(orjson.dumps(obj, default=_json_default), mimetype="application/json")
+
+def _get_json_body() -> Any:
+    """Parse the request body with orjson, failing the same way request.get_json() does"""
+    if not request.is_json:
+        return request.on_json_loading_failed(None)
+    try:
+        return orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError as e:
+        return request.on_json_loading_failed(e)
 
 reasoner_service = ReasonerService()
 
+# Static payloads serialized once, split around the timestamp that is spliced in per request
+_TS_PLACEHOLDER = "__TS__"
+
+def _split_payload(payload: Dict[str, Any]) -> Tuple[bytes, bytes]:
+    prefix, suffix = orjson.dumps(payload, default=_json_default).split(_TS_PLACEHOLDER.encode())
+    return prefix, suffix
+
+_TEMPLATE_BYTES = {
+    key: _split_payload(reasoner_service.fetch_template(key, _TS_PLACEHOLDER))
+    for key in reasoner_service.templates
+}
+_HEALTH_BYTES = _split_payload({
+    "status": "healthy",
+    "service": "reasoner",
+    "timestamp": _TS_PLACEHOLDER,
+    "templates_available": list(reasoner_service.templates.keys())
+})
+
+def _spliced_response(parts: Tuple[bytes, bytes]) -> Any:
+    prefix, suffix = parts
+    return app.response_class(prefix + _request_timestamp().encode() + suffix, mimetype="application/json")
+
+class RequestError(ValueError):
+    """Malformed request body, reported to the client as a 400"""
+
+class ContextRequest(NamedTuple):
+    student_id: str
+
+class ProposeRequest(NamedTuple):
+    stage: str
+    context: Mapping[str, Any] = _EMPTY
+    context_id: Optional[str] = None
+
+class ProposeBatchRequest(NamedTuple):
+    stages: List[str]
+    context: Mapping[str, Any] = _EMPTY
+
+# JSON type each request field must decode to
+_FIELD_TYPES = {"student_id": str, "stage": str, "context_id": str, "context": dict, "stages": list}
+
+_Req = TypeVar("_Req", ContextRequest, ProposeRequest, ProposeBatchRequest)
+
+def _parse_request(request_type: Type[_Req]) -> _Req:
+    """Decode the JSON body into a request tuple, checking required fields and types in one pass"""
+    try:
+        data = _get_json_body()
+    except HTTPException as e:
+        # Malformed JSON or a non-JSON content type
+        raise RequestError("request body must be valid JSON sent as application/json") from e
+    if not isinstance(data, dict):
+        raise RequestError("request body must be a JSON object")
+    values = []
+    for field in request_type._fields:
+        value = data.get(field)
+        if not value:
+            if field not in request_type._field_defaults:
+                raise RequestError(f"{field} is required")
+            value = request_type._field_defaults[field]
+        elif not isinstance(value, _FIELD_TYPES[field]):
+            raise RequestError(f"{field} must be a {_FIELD_TYPES[field].__name__}")
+        elif field == "stages" and not all(isinstance(stage, str) and stage for stage in value):
+            raise RequestError("stages must contain only non-empty strings")
+        values.append(value)
+    return request_type._make(values)
+
+def cached_endpoint(maxsize: int = RESPONSE_CACHE_SIZE):
+    """Memoize successful JSON responses of a deterministic endpoint by path and request body.
+
+    The request timestamp is cut out of the stored body and the current one is
+    spliced back in on every hit, so cached responses never carry a stale time.
+    """
+    def decorator(view):
+        memo: "OrderedDict[bytes, List[bytes]]" = OrderedDict()
+        lock = threading.Lock()
+        
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(request.path.encode())
+            digest.update(b"\0" + (request.mimetype or "").encode() + b"\0")
+            digest.update(request.get_data())
+            key = digest.digest()
+            
+            with lock:
+                parts = memo.get(key)
+                if parts is not None:
+                    memo.move_to_end(key)
+            if parts is not None:
+                ts = b'"' + _request_timestamp().encode() + b'"'
+                return app.response_class(ts.join(parts), status=200, mimetype="application/json")
+            
+            response = app.make_response(view(*args, **kwargs))
+            if response.status_code == 200:
+                ts = g.get("req_ts")
+                body = response.get_data()
+                parts = body.split(b'"' + ts.encode() + b'"') if ts else [body]
+                with lock:
+                    memo[key] = parts
+                    while len(memo) > maxsize:
+                        memo.popitem(last=False)
+            return response
+        return wrapper
+    return decorator
+
 @app.route('/context', methods=['POST'])
+@cached_endpoint()
 def fetch_context_endpoint():
     """API endpoint to fetch student context"""
     try:
-        data = request.get_json()
-        student_id = data.get('student_id')
-        if not student_id:
-            return jsonify({"error": "student_id is required"}), 400
-        
-        context = reasoner_service.fetch_context(student_id)
+        req = _parse_request(ContextRequest)
+        context = reasoner_service.fetch_context(req.student_id, _request_timestamp())
         return jsonify(context)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/context/cache', methods=['POST'])
+def cache_context_endpoint():
+    """API endpoint to store a shared stage context and return its id"""
+    try:
+        context = _get_json_body()
+        if not context:
+            return jsonify({"error": "context data is required"}), 400
+        
+        context_id = reasoner_service.cache_context(context)
+        return jsonify({"context_id": context_id})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/template/recommend', methods=['POST'])
+@cached_endpoint()
 def recommend_template_endpoint():
     """API endpoint to recommend lesson plan template"""
     try:
-        context = request.get_json()
+        context = _get_json_body()
         if not context:
             return jsonify({"error": "context data is required"}), 400
         
-        recommendation = reasoner_service.recommend_template(context)
+        recommendation = reasoner_service.recommend_template(context, _request_timestamp())
         return jsonify(recommendation)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -406,47 +801,61 @@ def recommend_template_endpoint():
 def fetch_template_endpoint(template_name):
     """API endpoint to fetch template definition"""
     try:
-        template = reasoner_service.fetch_template(template_name)
-        return jsonify(template)
+        parts = _TEMPLATE_BYTES.get(template_name.lower())
+        if parts is None:
+            # Unknown template; let the service raise its usual error
+            template = reasoner_service.fetch_template(template_name, _request_timestamp())
+            return jsonify(template)
+        return _spliced_response(parts)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/activities/propose', methods=['POST'])
+@cached_endpoint()
 def propose_activities_endpoint():
     """API endpoint to propose activities for a stage"""
     try:
-        data = request.get_json()
-        stage = data.get('stage')
-        context = data.get('context', {})
+        req = _parse_request(ProposeRequest)
         
-        if not stage:
-            return jsonify({"error": "stage is required"}), 400
+        if req.context_id:
+            shared_context = reasoner_service.get_cached_context(req.context_id)
+            if shared_context is None:
+                return jsonify({"error": f"Context {req.context_id} not found"}), 404
+            context = {**shared_context, "stage": req.stage}
+        else:
+            context = req.context
         
-        activities = reasoner_service.propose_activities(stage, context)
-        return jsonify(activities)
+        activities = reasoner_service.propose_activities(req.stage, context, _request_timestamp())
+        return _json_response(activities)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/activities/propose_batch', methods=['POST'])
+@cached_endpoint()
+def propose_activities_batch_endpoint():
+    """API endpoint to propose activities for several stages in one call"""
+    try:
+        req = _parse_request(ProposeBatchRequest)
+        results = reasoner_service.propose_activities_batch(req.stages, req.context, _request_timestamp())
+        return _json_response(results)
+    except RequestError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
-        "status": "healthy",
-        "service": "reasoner",
-        "timestamp": datetime.now().isoformat(),
-        "templates_available": list(reasoner_service.templates.keys())
-    })
+    return _spliced_response(_HEALTH_BYTES)
 
 if __name__ == "__main__":
-    print("Starting Reasoner Service...")
-    print("Available templates:", list(reasoner_service.templates.keys()))
-    print("Mock students:", list(reasoner_service.student_database.keys()))
-    print("\nAPI Endpoints:")
-    print("- POST /context - Fetch student context")
-    print("- POST /template/recommend - Recommend template")
-    print("- GET /templates/<name> - Fetch template")
-    print("- POST /activities/propose - Propose activities")
-    print("- GET /health - Health check")
-    print("\nStarting server on http://localhost:5000")
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    debug = os.environ.get("EDTECK_DEBUG") == "1"
+    logger.info(
+        "Starting reasoner development server on http://localhost:5000 (debug=%s, templates=%s); "
+        "serve wsgi:application with gunicorn in production",
+        debug, ",".join(reasoner_service.templates)
+    )
+    app.run(debug=debug, host='0.0.0.0', port=5000, use_reloader=False, threaded=True)
@@ -8,13 +8,18 @@ import os
 import sys
 try:
     import psycopg2
-    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+    from psycopg2 import sql
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT, TRANSACTION_STATUS_IDLE
+    from psycopg2.pool import ThreadedConnectionPool
     PSYCOPG2_AVAILABLE = True
 except ImportError:
     print("Warning: psycopg2 not available. Cannot setup PostgreSQL database.")
     PSYCOPG2_AVAILABLE = False
     psycopg2 = None
+    sql = None
     ISOLATION_LEVEL_AUTOCOMMIT = None
+    TRANSACTION_STATUS_IDLE = None
+    ThreadedConnectionPool = None
 
 try:
     from dotenv import load_dotenv
@@ -23,66 +28,452 @@ except ImportError:
     def load_dotenv():
         pass
 import argparse
+import csv
+import hashlib
 import logging
+import logging.handlers
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from graphlib import CycleError, TopologicalSorter
+from itertools import islice
+from types import SimpleNamespace
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
+# Configure logging; the log file is written in batches (and at once on errors or exit)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+_log_file_handler = logging.FileHandler('database_setup.log')
+_log_file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+_log_file_buffer = logging.handlers.MemoryHandler(
+    capacity=1000, flushLevel=logging.ERROR, target=_log_file_handler
+)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
         logging.StreamHandler(sys.stdout),
-        logging.FileHandler('database_setup.log')
+        _log_file_buffer
     ]
 )
 logger = logging.getLogger(__name__)
 
+# Rows folded into one multi-row INSERT, and statements sent to the server per round trip
+INSERT_PAGE_SIZE = 1000
+STATEMENT_PAGE_SIZE = 100
+
+# Migration files are read in blocks of whole lines of about this many bytes
+SQL_READ_BLOCK_SIZE = 1 << 20
+
+# Connections kept per pool (server-level and database-level)
+POOL_MIN_CONNECTIONS = 1
+POOL_MAX_CONNECTIONS = 4
+
+# How --migrate runs: in the foreground, on a background thread, or not at all
+MIGRATION_MODES = ('sync', 'async', 'skip')
+# Session advisory lock held by whichever process is running migrations
+MIGRATION_LOCK_KEY = 0x70656461
+
+# Bulk seed files loaded with COPY instead of INSERTs: NNN_seed_<table>.csv (header row
+# names the columns), or a .sql file whose first line is "-- @copy table=<t> columns=<a,b>"
+# followed by CSV data rows
+_COPY_SEED_FILE = re.compile(r"\d+_seed_([A-Za-z_][\w.]*)\.csv")
+_COPY_SENTINEL = re.compile(r"--\s*@copy\s+table=([A-Za-z_][\w.]*)\s+columns=([\w,]+)\s*$")
+
+# "-- @depends: 003,005" in a migration's leading comments lists the migrations it
+# needs; annotated migrations whose dependencies are met run concurrently
+_DEPENDS_ANNOTATION = re.compile(r"--\s*@depends:\s*([\d\s,]*)$")
+_MIGRATION_NUMBER = re.compile(r"\d+")
+
+# Top-level statements that end or start a transaction; a migration using them cannot
+# be dry-run inside the validation transaction
+_TRANSACTION_CONTROL = re.compile(
+    r"(?:BEGIN|START\s+TRANSACTION|COMMIT|END|ABORT|ROLLBACK(?!\s+TO\b)|PREPARE\s+TRANSACTION)\b",
+    re.IGNORECASE
+)
+
+# Run of SQL that cannot end a statement or open a multi-block token: plain text and
+# quoted strings/identifiers closed within the block. Whatever stops it is _SQL_SPECIAL.
+_SQL_CODE_RUN = re.compile(
+    r"""(?:[^;'"$/\-eE]+"""
+    r"""|'(?:[^']|'')*'(?!')""" r'|"(?:[^"]|"")*"(?!")'
+    r"""|[eE](?!')|(?<=[\w$])[eE]"""
+    r"""|/(?!\*)|-(?!-)|\$(?!(?:[A-Za-z_][A-Za-z_0-9]*)?\$))*"""
+)
+_SQL_SPECIAL = re.compile(r"""[;'"]|--|/\*|\$(?:[A-Za-z_][A-Za-z_0-9]*)?\$|[eE]'""")
+_ESTRING_SPECIAL = re.compile(r"\\.|''|'", re.S)
+_BLOCK_COMMENT_SPECIAL = re.compile(r"/\*|\*/")
+
+# INSERT with a literal VALUES list and nothing after it (no RETURNING / ON CONFLICT / SELECT)
+_INSERT_VALUES = re.compile(
+    r"""INSERT\s+INTO\s+((?:"(?:[^"]|"")+"(?!")|[\w.])+(?:\s*\([^()]*\))?)\s*VALUES\s*""",
+    re.IGNORECASE
+)
+# One row of plain literals; anything fancier goes through the tokenizer below. The
+# (?!') keeps 'a''b' from also matching as two strings, which backtracks exponentially
+_SIMPLE_ROW = re.compile(r"""\((?:[^'"()$\\]|'(?:[^'\\]|'')*'(?!'))*\)\s*""")
+_VALUES_TOKEN = re.compile(
+    r"""\s+|[(),]"""
+    r"""|(?<![\w$])[eE]'(?:[^'\\]|\\.|'')*'"""
+    r"""|'(?:[^']|'')*'""" r'|"(?:[^"]|"")*"'
+    r"""|\$([A-Za-z_]\w*|)\$.*?\$\1\$"""
+    r"""|[^\s(),'"$]+|\$""",
+    re.S
+)
+
+def _read_copy_sentinel(path: str) -> Optional[Tuple[str, List[str]]]:
+    """Return (table, columns) if a .sql file starts with the @copy sentinel"""
+    with open(path, 'r') as f:
+        m = _COPY_SENTINEL.match(f.readline())
+    return (m.group(1), m.group(2).split(',')) if m else None
+
+def _migration_sort_key(name: str) -> Tuple[int, str]:
+    """Order migrations by numeric prefix (9_x before 010_y), unnumbered files last"""
+    m = _MIGRATION_NUMBER.match(name)
+    return (int(m.group()) if m else sys.maxsize, name)
+
+def _file_sha256(path: str) -> bytes:
+    """SHA-256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(SQL_READ_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.digest()
+
+def _manages_transactions(path: str) -> bool:
+    """True if a SQL migration has its own top-level BEGIN/COMMIT/ROLLBACK statements"""
+    if _COPY_SEED_FILE.fullmatch(os.path.basename(path)) or _read_copy_sentinel(path):
+        return False
+    return any(_TRANSACTION_CONTROL.match(statement) for statement in _iter_sql_file(path))
+
+def _read_depends(path: str) -> Optional[List[int]]:
+    """Return the migration numbers from a leading '-- @depends:' comment, if any"""
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if not line.startswith('--'):
+                break
+            m = _DEPENDS_ANNOTATION.match(line)
+            if m:
+                return [int(n) for n in re.split(r'[\s,]+', m.group(1)) if n]
+    return None
+
+def _iter_sql_file(path: str) -> Iterator[str]:
+    """Statements of a migration file, streamed in line-aligned blocks"""
+    with open(path, 'r') as f:
+        blocks = ("".join(lines) for lines in iter(lambda: f.readlines(SQL_READ_BLOCK_SIZE), []))
+        yield from _iter_sql_statements(blocks)
+
+def _iter_sql_statements(blocks: Iterable[str]) -> Iterator[str]:
+    """Split SQL text into statements on top-level semicolons.
+
+    Quoted strings and identifiers, E'' strings, dollar-quoted bodies and
+    (nested) block comments are respected; comments are dropped. The text may
+    arrive in any number of blocks as long as each ends at a line break, since
+    none of those tokens can straddle one.
+    """
+    buf: List[str] = []
+    mode = None
+    tag = ""
+    depth = 0
+    for line in blocks:
+        pos, n = 0, len(line)
+        while pos < n:
+            if mode is None:
+                end = _SQL_CODE_RUN.match(line, pos).end()
+                buf.append(line[pos:end])
+                if end == n:
+                    break
+                m = _SQL_SPECIAL.match(line, end)
+                tok, pos = m.group(), m.end()
+                if tok == ";":
+                    statement = "".join(buf).strip()
+                    buf = []
+                    if statement:
+                        yield statement
+                elif tok == "--":
+                    pos = line.find("\n", pos)
+                    if pos < 0:
+                        break
+                elif tok == "/*":
+                    mode, depth = "comment", 1
+                    buf.append(" ")
+                else:
+                    buf.append(tok)
+                    if tok.startswith("$"):
+                        mode, tag = "dollar", tok
+                    elif tok == "'":
+                        mode = "string"
+                    elif tok == '"':
+                        mode = "ident"
+                    else:
+                        mode = "estring"
+            elif mode in ("string", "ident"):
+                quote = "'" if mode == "string" else '"'
+                i = line.find(quote, pos)
+                if i < 0:
+                    buf.append(line[pos:])
+                    break
+                if line.startswith(quote, i + 1):
+                    buf.append(line[pos:i + 2])
+                    pos = i + 2
+                else:
+                    buf.append(line[pos:i + 1])
+                    pos, mode = i + 1, None
+            elif mode == "estring":
+                m = _ESTRING_SPECIAL.search(line, pos)
+                if not m:
+                    buf.append(line[pos:])
+                    break
+                buf.append(line[pos:m.end()])
+                pos = m.end()
+                if m.group() == "'":
+                    mode = None
+            elif mode == "dollar":
+                i = line.find(tag, pos)
+                if i < 0:
+                    buf.append(line[pos:])
+                    break
+                buf.append(line[pos:i + len(tag)])
+                pos, mode = i + len(tag), None
+            else:
+                m = _BLOCK_COMMENT_SPECIAL.search(line, pos)
+                if not m:
+                    break
+                pos = m.end()
+                depth += 1 if m.group() == "/*" else -1
+                if depth == 0:
+                    mode = None
+    statement = "".join(buf).strip()
+    if statement:
+        yield statement
+
+def _is_values_list(sql: str) -> bool:
+    """True if sql is only a comma-separated list of parenthesized rows of literals.
+    
+    Rows with nested parentheses (function calls, subqueries) or SELECT are
+    refused: folded into one statement, a subquery would no longer see the rows
+    inserted before it.
+    """
+    if _SIMPLE_ROW.fullmatch(sql):
+        return True
+    pos = 0
+    in_row = False
+    expect_row = True
+    n = len(sql)
+    while pos < n:
+        m = _VALUES_TOKEN.match(sql, pos)
+        if not m:
+            return False
+        tok, pos = m.group(), m.end()
+        if in_row:
+            if tok == ")":
+                in_row = False
+            elif tok == "(" or tok.upper() == "SELECT":
+                return False
+        elif tok.isspace():
+            continue
+        elif tok == "(" and expect_row:
+            in_row, expect_row = True, False
+        elif tok == "," and not expect_row:
+            expect_row = True
+        else:
+            return False
+    return not in_row and not expect_row
+
+def _coalesce_inserts(statements: Iterable[str], page_size: int = INSERT_PAGE_SIZE) -> Iterator[str]:
+    """Fold runs of simple INSERT ... VALUES into the same table into multi-row INSERTs"""
+    target = raw_target = None
+    rows: List[str] = []
+    for statement in statements:
+        m = _INSERT_VALUES.match(statement) if statement[:6].upper() == "INSERT" else None
+        if m:
+            tail = statement[m.end():]
+            if _is_values_list(tail):
+                raw = m.group(1)
+                if raw != raw_target:
+                    raw_target, key = raw, " ".join(raw.split())
+                    if key != target or len(rows) >= page_size:
+                        if rows:
+                            yield f"INSERT INTO {target} VALUES {', '.join(rows)}"
+                        target, rows = key, []
+                elif len(rows) >= page_size:
+                    yield f"INSERT INTO {target} VALUES {', '.join(rows)}"
+                    rows = []
+                rows.append(tail)
+                continue
+        if rows:
+            yield f"INSERT INTO {target} VALUES {', '.join(rows)}"
+            target = raw_target = None
+            rows = []
+        yield statement
+    if rows:
+        yield f"INSERT INTO {target} VALUES {', '.join(rows)}"
+
+@lru_cache(maxsize=None)
+def _config() -> SimpleNamespace:
+    """Database settings from the environment (and .env), read once per process"""
+    host = os.getenv('DB_HOST', 'localhost')
+    port = os.getenv('DB_PORT', '5432')
+    database = os.getenv('DB_NAME', 'dummydata')
+    username = os.getenv('DB_USER', 'postgres')
+    password = os.getenv('DB_PASSWORD', '223344')
+    
+    # Connection parameters for connecting to PostgreSQL server (without specific database).
+    # Encoding and application name are pinned; TCP keepalives let idle pooled
+    # connections be detected as dead instead of hanging
+    server_conn_params = dict(
+        host=host,
+        port=port,
+        user=username,
+        password=password,
+        client_encoding='UTF8',
+        application_name='pedagogy-setup',
+        connect_timeout=5,
+        keepalives=1,
+        keepalives_idle=30
+    )
+    
+    return SimpleNamespace(
+        host=host,
+        port=port,
+        database=database,
+        username=username,
+        password=password,
+        server_conn_params=server_conn_params,
+        # Connection parameters for connecting to the specific database
+        db_conn_params=dict(server_conn_params, dbname=database),
+        migration_mode=os.getenv('MIGRATION_MODE', 'sync')
+    )
+
 class DatabaseSetup:
     """Handle database setup operations"""
     
     def __init__(self):
-        self.host = os.getenv('DB_HOST', 'localhost')
-        self.port = os.getenv('DB_PORT', '5432')
-        self.database = os.getenv('DB_NAME', 'dummydata')
-        self.username = os.getenv('DB_USER', 'postgres')
-        self.password = os.getenv('DB_PASSWORD', '223344')
+        config = _config()
+        self.host = config.host
+        self.port = config.port
+        self.database = config.database
+        self.username = config.username
+        self.password = config.password
+        
+        # Per-instance copies, so adjusting one setup's parameters leaves others alone
+        self.server_conn_params = dict(config.server_conn_params)
+        self.db_conn_params = dict(config.db_conn_params)
+        
+        # Connection pools, created on first use
+        self._server_pool = None
+        self._db_pool = None
+        self._pool_lock = threading.Lock()
+        
+        # Migration mode, and the state of a background (async) migration run
+        self.migration_mode = config.migration_mode
+        self.validate_migrations = False
+        self._status_conn = None
+        self._migration_thread = None
+        self._migration_result = None
+    
+    def _get_conn(self, server: bool = False) -> Tuple["psycopg2.extensions.connection", Callable]:
+        """Borrow a pooled connection; returns (conn, release) and release(conn) hands it back"""
+        with self._pool_lock:
+            pool = self._server_pool if server else self._db_pool
+            if pool is None:
+                pool = ThreadedConnectionPool(
+                    POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS,
+                    **(self.server_conn_params if server else self.db_conn_params)
+                )
+                if server:
+                    self._server_pool = pool
+                else:
+                    self._db_pool = pool
         
-        # Connection string for connecting to PostgreSQL server (without specific database)
-        self.server_conn_string = f"host={self.host} port={self.port} user={self.username} password={self.password}"
+        conn = pool.getconn()
+        try:
+            # Pooled connections can be dropped by the server (restart, or
+            # pg_terminate_backend in reset_database); replace dead ones
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
         
-        # Connection string for connecting to the specific database
-        self.db_conn_string = f"{self.server_conn_string} dbname={self.database}"
+        if server:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        return conn, pool.putconn
+    
+    @contextmanager
+    def _connection(self, server: bool = False) -> Iterator["psycopg2.extensions.connection"]:
+        """Borrow a pooled connection for a with block; it is returned to the pool on exit"""
+        conn, release = self._get_conn(server)
+        try:
+            yield conn
+        finally:
+            release(conn)
+    
+    def close(self) -> None:
+        """Close all pooled connections"""
+        for pool in (self._server_pool, self._db_pool):
+            if pool is not None:
+                pool.closeall()
+        self._server_pool = self._db_pool = None
     
     def create_database(self) -> bool:
         """Create the pedagogy database if it doesn't exist"""
         try:
             # Connect to PostgreSQL server
-            conn = psycopg2.connect(self.server_conn_string)
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            cursor = conn.cursor()
-            
-            # Check if database exists
-            cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (self.database,))
-            exists = cursor.fetchone()
-            
-            if exists:
-                logger.info(f"Database '{self.database}' already exists")
+            with self._connection(server=True) as conn, conn.cursor() as cursor:
+                # Check if database exists
+                cursor.execute("SELECT 1 FROM pg_database WHERE datname = %s", (self.database,))
+                exists = cursor.fetchone()
+                
+                if exists:
+                    logger.info(f"Database '{self.database}' already exists")
+                    return True
+                
+                # Create database
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.database)))
+                logger.info(f"Database '{self.database}' created successfully")
+                
                 return True
             
-            # Create database
-            cursor.execute(f"CREATE DATABASE {self.database}")
-            logger.info(f"Database '{self.database}' created successfully")
-            
-            cursor.close()
-            conn.close()
-            return True
-            
         except Exception as e:
             logger.error(f"Error creating database: {e}")
             return False
     
+    def _run_migration_with_cursor(self, cursor, migration_file: str) -> None:
+        """Execute a migration file on an open cursor, leaving the commit to the caller"""
+        # Stream the migration in line-aligned blocks, fold its INSERTs and send the
+        # statements a page per round trip; psycopg2 keeps them all in one
+        # transaction until commit. Small files arrive as a single block.
+        statements = _coalesce_inserts(_iter_sql_file(migration_file))
+        while True:
+            page = list(islice(statements, STATEMENT_PAGE_SIZE))
+            if not page:
+                break
+            cursor.execute(";\n".join(page))
+    
+    def _copy_with_cursor(self, cursor, table: str, csv_path: str, columns: List[str]) -> None:
+        """COPY a CSV seed file into a table on an open cursor, leaving the commit to the caller"""
+        with open(csv_path, 'r', newline='') as f:
+            # A sentinel .sql file carries data rows after its first line; a
+            # seed .csv carries a header row that COPY skips
+            header = not f.readline().lstrip().startswith('--')
+            if header:
+                f.seek(0)
+            copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT CSV, HEADER {})").format(
+                sql.Identifier(*table.split('.')),
+                sql.SQL(', ').join(map(sql.Identifier, columns)),
+                sql.SQL('TRUE' if header else 'FALSE')
+            )
+            cursor.copy_expert(copy_sql, f)
+    
     def run_migration(self, migration_file: str) -> bool:
         """Run a specific migration file"""
         try:
@@ -91,37 +482,174 @@ class DatabaseSetup:
                 return False
             
             # Connect to the database
-            conn = psycopg2.connect(self.db_conn_string)
-            cursor = conn.cursor()
-            
-            # Read and execute migration file
-            with open(migration_file, 'r') as f:
-                migration_sql = f.read()
+            with self._connection() as conn, conn.cursor() as cursor:
+                self._run_migration_with_cursor(cursor, migration_file)
+                conn.commit()
+                
+                logger.info(f"Migration executed successfully: {migration_file}")
+                
+                return True
             
-            cursor.execute(migration_sql)
-            conn.commit()
+        except Exception as e:
+            logger.error(f"Error running migration {migration_file}: {e}")
+            return False
+    
+    def run_copy_migration(self, table: str, csv_path: str, columns: List[str]) -> bool:
+        """Bulk-load a CSV seed file into a table with COPY FROM STDIN"""
+        try:
+            if not os.path.exists(csv_path):
+                logger.error(f"Migration file not found: {csv_path}")
+                return False
             
-            logger.info(f"Migration executed successfully: {migration_file}")
+            with self._connection() as conn, conn.cursor() as cursor:
+                self._copy_with_cursor(cursor, table, csv_path, columns)
+                conn.commit()
+                
+                logger.info(f"Seed data copied into {table}: {csv_path}")
+                
+                return True
             
-            cursor.close()
-            conn.close()
-            return True
+        except Exception as e:
+            logger.error(f"Error copying seed data {csv_path}: {e}")
+            return False
+    
+    def _run_migration_file(self, cursor, file_path: str) -> None:
+        """Run one migration on an open cursor, routing bulk seed files through COPY"""
+        name = os.path.basename(file_path)
+        m = _COPY_SEED_FILE.fullmatch(name)
+        if m:
+            with open(file_path, 'r', newline='') as f:
+                columns = next(csv.reader(f), [])
+            self._copy_with_cursor(cursor, m.group(1), file_path, columns)
+            return
+        
+        copy_target = _read_copy_sentinel(file_path)
+        if copy_target:
+            self._copy_with_cursor(cursor, copy_target[0], file_path, copy_target[1])
+            return
+        
+        self._run_migration_with_cursor(cursor, file_path)
+    
+    def _acquire_migration_lock(self) -> bool:
+        """Take the migration advisory lock on a dedicated connection; False if another run holds it"""
+        # Kept outside the pool: the session lock lives as long as this
+        # connection, and parallel migrations may need every pooled one
+        conn = None
+        try:
+            conn = psycopg2.connect(**self.db_conn_params)
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_KEY,))
+                locked = cursor.fetchone()[0]
+                if locked:
+                    cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS migration_status (
+                            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                            state TEXT NOT NULL,
+                            current_file TEXT,
+                            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                        )
+                    """)
             
         except Exception as e:
-            logger.error(f"Error running migration {migration_file}: {e}")
+            logger.error(f"Error acquiring migration lock: {e}")
+            if conn is not None:
+                conn.close()
             return False
+        
+        if not locked:
+            logger.error("Another migration run is in progress on this database")
+            conn.close()
+            return False
+        
+        self._status_conn = conn
+        return True
+    
+    def _release_migration_lock(self) -> None:
+        """Close the lock connection, which releases the advisory lock"""
+        conn, self._status_conn = self._status_conn, None
+        if conn is not None:
+            conn.close()
+    
+    def _set_migration_status(self, state: str, current_file: Optional[str] = None) -> None:
+        """Record migration progress (pending/running/succeeded/failed) in migration_status"""
+        if self._status_conn is None:
+            return
+        try:
+            with self._status_conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO migration_status (id, state, current_file, updated_at)
+                    VALUES (TRUE, %s, %s, now())
+                    ON CONFLICT (id) DO UPDATE SET
+                        state = EXCLUDED.state,
+                        current_file = EXCLUDED.current_file,
+                        updated_at = EXCLUDED.updated_at
+                """, (state, current_file))
+        except psycopg2.Error as e:
+            logger.warning(f"Could not update migration status: {e}")
     
     def run_all_migrations(self) -> bool:
         """Run all migration files in order"""
+        if not self._acquire_migration_lock():
+            return False
+        try:
+            return self._run_all_migrations_locked()
+        finally:
+            self._release_migration_lock()
+    
+    def start_migrations(self) -> bool:
+        """Run all migrations on a background thread; False if they could not be started"""
+        if not self._acquire_migration_lock():
+            return False
+        self._set_migration_status('pending')
+        self._migration_result = None
+        self._migration_thread = threading.Thread(
+            target=self._run_migrations_in_background, name='migrations', daemon=True
+        )
+        self._migration_thread.start()
+        return True
+    
+    def wait_for_migrations(self, timeout: Optional[float] = None) -> Optional[bool]:
+        """Wait for background migrations; returns their result, or None if still running"""
+        thread = self._migration_thread
+        if thread is not None:
+            thread.join(timeout)
+            if thread.is_alive():
+                return None
+        return self._migration_result
+    
+    def _run_migrations_in_background(self) -> None:
+        try:
+            self._migration_result = self._run_all_migrations_locked()
+        except Exception as e:
+            logger.error(f"Error running migrations: {e}")
+            self._migration_result = False
+        finally:
+            self._release_migration_lock()
+    
+    def _run_all_migrations_locked(self) -> bool:
+        """Run all migrations while holding the migration lock, recording progress"""
+        self._set_migration_status('running')
+        success = self._run_all_migrations()
+        self._set_migration_status('succeeded' if success else 'failed')
+        return success
+    
+    def _run_all_migrations(self) -> bool:
         migrations_dir = "migrations"
         
         if not os.path.exists(migrations_dir):
             logger.error(f"Migrations directory not found: {migrations_dir}")
             return False
         
-        # Get all SQL files in migrations directory and sort them
-        migration_files = [f for f in os.listdir(migrations_dir) if f.endswith('.sql')]
-        migration_files.sort()
+        # Get all SQL files and CSV seed files in migrations directory and sort them
+        with os.scandir(migrations_dir) as entries:
+            migration_files = sorted(
+                (
+                    e.name for e in entries
+                    if (e.name.endswith('.sql') or _COPY_SEED_FILE.fullmatch(e.name)) and e.is_file()
+                ),
+                key=_migration_sort_key
+            )
         
         if not migration_files:
             logger.warning("No migration files found")
@@ -129,34 +657,238 @@ class DatabaseSetup:
         
         logger.info(f"Found {len(migration_files)} migration files")
         
-        success = True
-        for migration_file in migration_files:
-            file_path = os.path.join(migrations_dir, migration_file)
-            logger.info(f"Running migration: {migration_file}")
-            
-            if not self.run_migration(file_path):
-                logger.error(f"Migration failed: {migration_file}")
-                success = False
-                break
+        file_paths = [os.path.join(migrations_dir, f) for f in migration_files]
+        digests = {path: _file_sha256(path) for path in file_paths}
+        
+        # Skip files already recorded in schema_migrations with the same content
+        applied = self._applied_migrations(migration_files)
+        if applied is None:
+            return False
+        changed = [
+            os.path.basename(path) for path in file_paths
+            if os.path.basename(path) in applied and applied[os.path.basename(path)] != digests[path]
+        ]
+        if changed:
+            logger.error(f"Applied migrations changed since they were run: {changed}")
+            return False
+        pending = [path for path in file_paths if os.path.basename(path) not in applied]
+        if len(pending) < len(file_paths):
+            logger.info(f"{len(file_paths) - len(pending)} migrations already applied, {len(pending)} pending")
+        
+        depends = {path: _read_depends(path) for path in pending}
+        graph = None
+        if any(deps is not None for deps in depends.values()):
+            graph = self._migration_graph(file_paths, pending, depends)
+            if graph is None:
+                return False
+        
+        if self.validate_migrations and pending:
+            order = pending if graph is None else list(TopologicalSorter(graph).static_order())
+            if not self._validate_all(order):
+                return False
+        
+        if graph is None:
+            success = self._run_migrations_serial(pending, digests)
+        else:
+            success = self._run_migrations_parallel(graph, digests)
         
         if success:
             logger.info("All migrations completed successfully")
         
         return success
     
-    def test_connection(self) -> bool:
-        """Test database connection"""
+    def _applied_migrations(self, filenames: List[str]) -> Optional[Dict[str, bytes]]:
+        """Return {filename: sha256} for the given files already recorded as applied"""
         try:
-            conn = psycopg2.connect(self.db_conn_string)
-            cursor = conn.cursor()
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_migrations (
+                        filename TEXT PRIMARY KEY,
+                        sha256 BYTEA NOT NULL,
+                        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """)
+                cursor.execute(
+                    "SELECT filename, sha256 FROM schema_migrations WHERE filename = ANY(%s)",
+                    (filenames,)
+                )
+                applied = {row[0]: bytes(row[1]) for row in cursor.fetchall()}
+                conn.commit()
+                
+                return applied
             
-            cursor.execute("SELECT version()")
-            version = cursor.fetchone()
-            logger.info(f"Database connection successful. PostgreSQL version: {version[0]}")
+        except Exception as e:
+            logger.error(f"Error reading applied migrations: {e}")
+            return None
+    
+    def _apply_migration(self, cursor, file_path: str, digest: bytes) -> None:
+        """Run one migration and record it in schema_migrations, in the caller's transaction"""
+        self._run_migration_file(cursor, file_path)
+        cursor.execute("""
+            INSERT INTO schema_migrations (filename, sha256) VALUES (%s, %s)
+            ON CONFLICT (filename) DO UPDATE SET sha256 = EXCLUDED.sha256, applied_at = now()
+        """, (os.path.basename(file_path), digest))
+    
+    def _run_migrations_serial(self, file_paths: List[str], digests: Dict[str, bytes]) -> bool:
+        """Run migrations one after another on a single connection"""
+        # One connection for the whole run; each file is still its own
+        # transaction, so a failure rolls back only that file
+        try:
+            with self._connection() as conn, conn.cursor() as cursor:
+                for file_path in file_paths:
+                    logger.info(f"Running migration: {os.path.basename(file_path)}")
+                    self._set_migration_status('running', os.path.basename(file_path))
+                    
+                    try:
+                        self._apply_migration(cursor, file_path, digests[file_path])
+                        conn.commit()
+                    except Exception as e:
+                        conn.rollback()
+                        logger.error(f"Error running migration {file_path}: {e}")
+                        logger.error(f"Migration failed: {os.path.basename(file_path)}")
+                        return False
+                    
+                    logger.info(f"Migration executed successfully: {file_path}")
             
-            cursor.close()
-            conn.close()
-            return True
+        except Exception as e:
+            logger.error(f"Error running migrations: {e}")
+            return False
+        
+        return True
+    
+    def _run_pooled_migration(self, file_path: str, digest: bytes) -> bool:
+        """Run one migration on its own pooled connection (parallel worker)"""
+        try:
+            with self._connection() as conn, conn.cursor() as cursor:
+                logger.info(f"Running migration: {os.path.basename(file_path)}")
+                self._apply_migration(cursor, file_path, digest)
+                conn.commit()
+                logger.info(f"Migration executed successfully: {file_path}")
+                
+                return True
+            
+        except Exception as e:
+            logger.error(f"Error running migration {file_path}: {e}")
+            return False
+    
+    def _validate_all(self, file_paths: List[str]) -> bool:
+        """Dry-run migrations in one transaction that is rolled back.
+        
+        Each file runs under a savepoint on top of the files before it, so every
+        failing file is reported before any migration is committed. Validation
+        stops before the first file with its own transaction control, since its
+        COMMIT would end the dry run; later files depend on it and go unchecked.
+        """
+        self._set_migration_status('validating')
+        for i, file_path in enumerate(file_paths):
+            if _manages_transactions(file_path):
+                logger.warning(f"{os.path.basename(file_path)} manages its own transactions; "
+                               f"it and the {len(file_paths) - i - 1} migrations after it are not validated")
+                file_paths = file_paths[:i]
+                break
+        
+        try:
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute("SET LOCAL check_function_bodies = true")
+                failed = []
+                for file_path in file_paths:
+                    cursor.execute("SAVEPOINT migration_check")
+                    try:
+                        self._run_migration_file(cursor, file_path)
+                        error = None
+                    except psycopg2.Error as e:
+                        error = e
+                    
+                    # Anything that slipped past the scan and ended the transaction
+                    # has committed for real; stop rather than apply on top of it
+                    if conn.get_transaction_status() == TRANSACTION_STATUS_IDLE:
+                        logger.error(f"{os.path.basename(file_path)} ended the validation transaction; "
+                                     "its changes up to that point were committed")
+                        return False
+                    
+                    if error is not None:
+                        cursor.execute("ROLLBACK TO SAVEPOINT migration_check")
+                        logger.error(f"Migration failed validation: {os.path.basename(file_path)}: {error}")
+                        failed.append(os.path.basename(file_path))
+                    else:
+                        cursor.execute("RELEASE SAVEPOINT migration_check")
+                conn.rollback()
+                
+                if failed:
+                    logger.error(f"{len(failed)} migrations failed validation; none were applied")
+                    return False
+                logger.info(f"Validated {len(file_paths)} migrations")
+                return True
+            
+        except Exception as e:
+            logger.error(f"Error validating migrations: {e}")
+            return False
+    
+    def _migration_graph(self, file_paths: List[str], pending: List[str],
+                         depends: Dict[str, Optional[List[int]]]) -> Optional[Dict[str, List[str]]]:
+        """Map each pending migration to the pending migrations it waits for.
+        
+        Files with an @depends annotation wait only for the migrations they list;
+        files without one wait for every pending file sorted before them, as in a
+        serial run. Dependencies on already applied files are satisfied.
+        """
+        by_number: Dict[int, str] = {}
+        for path in file_paths:
+            m = _MIGRATION_NUMBER.match(os.path.basename(path))
+            if m:
+                by_number.setdefault(int(m.group()), path)
+        
+        pending_set = set(pending)
+        graph: Dict[str, List[str]] = {}
+        for i, path in enumerate(pending):
+            deps = depends[path]
+            if deps is None:
+                graph[path] = pending[:i]
+                continue
+            unknown = [n for n in deps if n not in by_number]
+            if unknown:
+                logger.error(f"Unknown @depends migrations in {path}: {unknown}")
+                return None
+            graph[path] = [by_number[n] for n in deps if by_number[n] in pending_set]
+        
+        try:
+            TopologicalSorter(graph).prepare()
+        except CycleError as e:
+            logger.error(f"Migration dependency cycle: {e.args[1]}")
+            return None
+        
+        return graph
+    
+    def _run_migrations_parallel(self, graph: Dict[str, List[str]], digests: Dict[str, bytes]) -> bool:
+        """Run migrations in dependency waves, each wave's files concurrently"""
+        sorter = TopologicalSorter(graph)
+        sorter.prepare()
+        # One pooled connection stays free for the steps main() runs alongside
+        # async migrations (--test), so getconn() never runs dry
+        with ThreadPoolExecutor(max_workers=POOL_MAX_CONNECTIONS - 1) as executor:
+            while sorter.is_active():
+                ready = sorted(sorter.get_ready())
+                if len(ready) > 1:
+                    logger.info(f"Running {len(ready)} independent migrations concurrently")
+                self._set_migration_status('running', ', '.join(os.path.basename(path) for path in ready))
+                results = list(executor.map(self._run_pooled_migration, ready, [digests[path] for path in ready]))
+                failed = [os.path.basename(path) for path, ok in zip(ready, results) if not ok]
+                if failed:
+                    logger.error(f"Migration failed: {', '.join(failed)}")
+                    return False
+                sorter.done(*ready)
+        
+        return True
+    
+    def test_connection(self) -> bool:
+        """Test database connection"""
+        try:
+            with self._connection() as conn, conn.cursor() as cursor:
+                cursor.execute("SELECT version()")
+                version = cursor.fetchone()
+                logger.info(f"Database connection successful. PostgreSQL version: {version[0]}")
+                
+                return True
             
         except Exception as e:
             logger.error(f"Database connection failed: {e}")
@@ -166,28 +898,30 @@ class DatabaseSetup:
         """Drop and recreate the database (WARNING: This will delete all data!)"""
         try:
             # Connect to PostgreSQL server
-            conn = psycopg2.connect(self.server_conn_string)
-            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
-            cursor = conn.cursor()
-            
-            # Terminate existing connections to the database
-            cursor.execute("""
-                SELECT pg_terminate_backend(pid)
-                FROM pg_stat_activity
-                WHERE datname = %s AND pid <> pg_backend_pid()
-            """, (self.database,))
-            
-            # Drop database if exists
-            cursor.execute(f"DROP DATABASE IF EXISTS {self.database}")
-            logger.info(f"Database '{self.database}' dropped")
-            
-            # Create database
-            cursor.execute(f"CREATE DATABASE {self.database}")
-            logger.info(f"Database '{self.database}' recreated")
-            
-            cursor.close()
-            conn.close()
-            return True
+            with self._connection(server=True) as conn, conn.cursor() as cursor:
+                if conn.server_version >= 130000:
+                    # Terminate existing connections and drop in one statement, so no
+                    # new connection can slip in between the two
+                    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(
+                        sql.Identifier(self.database)
+                    ))
+                else:
+                    # Terminate existing connections to the database
+                    cursor.execute("""
+                        SELECT pg_terminate_backend(pid)
+                        FROM pg_stat_activity
+                        WHERE datname = %s AND pid <> pg_backend_pid()
+                    """, (self.database,))
+                    
+                    # Drop database if exists
+                    cursor.execute(sql.SQL("DROP DATABASE IF EXISTS {}").format(sql.Identifier(self.database)))
+                logger.info(f"Database '{self.database}' dropped")
+                
+                # Create database
+                cursor.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.database)))
+                logger.info(f"Database '{self.database}' recreated")
+                
+                return True
             
         except Exception as e:
             logger.error(f"Error resetting database: {e}")
@@ -196,33 +930,26 @@ class DatabaseSetup:
     def check_tables(self) -> bool:
         """Check if required tables exist"""
         try:
-            conn = psycopg2.connect(self.db_conn_string)
-            cursor = conn.cursor()
-            
-            # Check for key tables
-            required_tables = ['students', 'templates', 'activities', 'lesson_plans']
-            
-            cursor.execute("""
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
-            """)
-            
-            existing_tables = [row[0] for row in cursor.fetchall()]
-            
-            logger.info(f"Found {len(existing_tables)} tables: {existing_tables}")
-            
-            missing_tables = [table for table in required_tables if table not in existing_tables]
-            
-            if missing_tables:
-                logger.warning(f"Missing required tables: {missing_tables}")
-                return False
-            else:
-                logger.info("All required tables exist")
-                return True
-            
-            cursor.close()
-            conn.close()
+            with self._connection() as conn, conn.cursor() as cursor:
+                # Check for key tables
+                required_tables = ['students', 'templates', 'activities', 'lesson_plans']
+                
+                # Let the server return only the missing ones; pg_tables avoids the
+                # permission-checking view expansion of information_schema.tables
+                cursor.execute("""
+                    SELECT t
+                    FROM unnest(%s::text[]) AS t
+                    WHERE t NOT IN (SELECT tablename FROM pg_tables WHERE schemaname = 'public')
+                """, (required_tables,))
+                
+                missing_tables = [row[0] for row in cursor.fetchall()]
+                
+                if missing_tables:
+                    logger.warning(f"Missing required tables: {missing_tables}")
+                    return False
+                else:
+                    logger.info("All required tables exist")
+                    return True
             
         except Exception as e:
             logger.error(f"Error checking tables: {e}")
@@ -243,21 +970,45 @@ def main():
     parser.add_argument('--test', action='store_true', help='Test database connection')
     parser.add_argument('--check', action='store_true', help='Check database tables')
     parser.add_argument('--full-setup', action='store_true', help='Full setup: create database and run migrations')
+    parser.add_argument('--migration-mode', choices=MIGRATION_MODES,
+                        help='Run migrations in the foreground (sync), in the background (async) or not at all '
+                             '(skip); defaults to MIGRATION_MODE or sync')
+    parser.add_argument('--migration-wait-timeout', type=float, metavar='SECONDS',
+                        help='In async mode, how long to wait for migrations to finish before exiting')
+    parser.add_argument('--yes', '-y', action='store_true',
+                        help='Do not ask for confirmation before --reset (also PEDAGOGY_ASSUME_YES=1)')
+    parser.add_argument('--validate', action='store_true',
+                        help='Dry-run all pending migrations in a rolled-back transaction before applying any')
+    parser.add_argument('--quiet', '-q', action='store_true', help='Only log warnings and errors')
     
     args = parser.parse_args()
     
-    if not any(vars(args).values()):
+    if not any((args.create, args.migrate, args.reset, args.test, args.check, args.full_setup)):
         parser.print_help()
         return
     
+    if args.quiet:
+        logger.setLevel(logging.WARNING)
+    
     setup = DatabaseSetup()
+    if args.validate:
+        setup.validate_migrations = True
+    migration_mode = args.migration_mode or setup.migration_mode
+    if migration_mode not in MIGRATION_MODES:
+        parser.error(f"invalid MIGRATION_MODE {migration_mode!r} (choose from {', '.join(MIGRATION_MODES)})")
     
     logger.info("Starting database setup...")
     logger.info(f"Target database: {setup.database} on {setup.host}:{setup.port}")
     
     if args.reset:
         logger.warning("RESETTING DATABASE - ALL DATA WILL BE LOST!")
-        confirm = input("Are you sure you want to reset the database? Type 'yes' to confirm: ")
+        if args.yes or os.getenv('PEDAGOGY_ASSUME_YES') == '1':
+            confirm = 'yes'
+        elif not sys.stdin.isatty():
+            logger.error("Cannot confirm reset without a terminal; pass --yes or set PEDAGOGY_ASSUME_YES=1")
+            sys.exit(1)
+        else:
+            confirm = input("Are you sure you want to reset the database? Type 'yes' to confirm: ")
         if confirm.lower() == 'yes':
             if not setup.reset_database():
                 logger.error("Database reset failed")
@@ -272,7 +1023,14 @@ def main():
             sys.exit(1)
     
     if args.migrate or args.full_setup:
-        if not setup.run_all_migrations():
+        if migration_mode == 'skip':
+            logger.info("Skipping migrations (migration mode: skip)")
+        elif migration_mode == 'async':
+            if not setup.start_migrations():
+                logger.error("Migrations failed to start")
+                sys.exit(1)
+            logger.info("Migrations running in the background")
+        elif not setup.run_all_migrations():
             logger.error("Migrations failed")
             sys.exit(1)
     
@@ -281,12 +1039,28 @@ def main():
             logger.error("Connection test failed")
             sys.exit(1)
     
+    # Background migrations end with the process, so wait for them before
+    # checking the tables and exiting
+    if (args.migrate or args.full_setup) and migration_mode == 'async':
+        migrated = setup.wait_for_migrations(args.migration_wait_timeout)
+        if migrated is None:
+            logger.error(f"Migrations still running after {args.migration_wait_timeout}s; "
+                         "exiting interrupts them and the current file is rolled back")
+            sys.exit(1)
+        if not migrated:
+            logger.error("Migrations failed")
+            sys.exit(1)
+    
     if args.check:
         if not setup.check_tables():
             logger.error("Table check failed")
             sys.exit(1)
     
+    setup.close()
     logger.info("Database setup completed successfully!")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        _log_file_buffer.flush()
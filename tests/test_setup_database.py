@@ -0,0 +1,88 @@
+"""Tests for the SQL statement splitter and INSERT folding in setup_database"""
+import time
+import unittest
+
+from setup_database import _coalesce_inserts, _is_values_list, _iter_sql_statements
+
+
+def split(*blocks):
+    return list(_iter_sql_statements(blocks))
+
+
+class IterSqlStatementsTest(unittest.TestCase):
+    def test_splits_on_top_level_semicolons(self):
+        self.assertEqual(split("SELECT 1;\nSELECT 2;\n"), ["SELECT 1", "SELECT 2"])
+
+    def test_trailing_statement_without_semicolon(self):
+        self.assertEqual(split("SELECT 1;\nSELECT 2\n"), ["SELECT 1", "SELECT 2"])
+
+    def test_semicolons_inside_quotes_are_kept(self):
+        self.assertEqual(
+            split("INSERT INTO t VALUES ('a;b', 'it''s');\n", 'SELECT "x;y" FROM t;\n'),
+            ["INSERT INTO t VALUES ('a;b', 'it''s')", 'SELECT "x;y" FROM t'],
+        )
+
+    def test_escape_strings(self):
+        self.assertEqual(split("SELECT E'a\\';b';\nSELECT 2;\n"), ["SELECT E'a\\';b'", "SELECT 2"])
+
+    def test_dollar_quoted_body_across_blocks(self):
+        body = "CREATE FUNCTION f() RETURNS int AS $fn$\nBEGIN\n  RETURN 1;\nEND\n$fn$ LANGUAGE plpgsql"
+        self.assertEqual(split(*(line + "\n" for line in (body + ";").split("\n"))), [body])
+
+    def test_comments_are_dropped(self):
+        self.assertEqual(
+            split("-- a; comment\nSELECT 1; /* outer /* nested; */ still; */ SELECT 2;\n"),
+            ["SELECT 1", "SELECT 2"],
+        )
+
+
+class IsValuesListTest(unittest.TestCase):
+    def test_literal_rows(self):
+        self.assertTrue(_is_values_list("(1, 'a''b', NULL), (2, 'c', E'd\\'e')"))
+        self.assertTrue(_is_values_list("('x'::text, $$y$$)"))
+
+    def test_rejects_nested_parentheses_and_subqueries(self):
+        self.assertFalse(_is_values_list("(1, now())"))
+        self.assertFalse(_is_values_list("('kid', (SELECT id FROM c WHERE name = 'root'))"))
+        self.assertFalse(_is_values_list("(1) RETURNING id"))
+
+    def test_many_quote_escapes_do_not_backtrack(self):
+        text = "It''s the student''s " * 40
+        start = time.perf_counter()
+        self.assertFalse(_is_values_list(f"('{text}', now())"))
+        self.assertTrue(_is_values_list(f"('{text}'), ('x')"))
+        self.assertLess(time.perf_counter() - start, 1)
+
+
+class CoalesceInsertsTest(unittest.TestCase):
+    def test_folds_runs_into_the_same_table(self):
+        statements = [
+            "INSERT INTO t (a) VALUES (1)",
+            "INSERT INTO t (a) VALUES ('it''s')",
+            "INSERT INTO u VALUES (2)",
+            "SELECT 1",
+        ]
+        self.assertEqual(list(_coalesce_inserts(statements)), [
+            "INSERT INTO t (a) VALUES (1), ('it''s')",
+            "INSERT INTO u VALUES (2)",
+            "SELECT 1",
+        ])
+
+    def test_subquery_rows_are_not_folded(self):
+        statements = [
+            "INSERT INTO c (name, parent) VALUES ('root', NULL)",
+            "INSERT INTO c (name, parent) VALUES ('kid', (SELECT id FROM c WHERE name = 'root'))",
+        ]
+        self.assertEqual(list(_coalesce_inserts(statements)), statements)
+
+    def test_page_size_splits_runs(self):
+        statements = [f"INSERT INTO t VALUES ({i})" for i in range(5)]
+        self.assertEqual(list(_coalesce_inserts(statements, page_size=2)), [
+            "INSERT INTO t VALUES (0), (1)",
+            "INSERT INTO t VALUES (2), (3)",
+            "INSERT INTO t VALUES (4)",
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,12 @@
+"""WSGI entry point for the reasoner service.
+
+Serve it with a worker pool instead of the Flask development server, e.g.:
+
+    gunicorn -w $(nproc) -k gthread --threads 4 --preload -b 0.0.0.0:5000 wsgi:application
+
+--preload imports reasoner once in the master so the template and student
+tables are built a single time and shared copy-on-write by the workers.
+"""
+from reasoner import app
+
+application = app